@@ -0,0 +1,97 @@
+"""
+A minimal stand-in for :class:`storymarket.Storymarket` that talks to
+:class:`~benchmarks.fakeserver.FakeStorymarketServer` over real HTTP.
+
+Benchmarks patch ``storymarket.Storymarket`` with :func:`make_api_class`,
+so django-storymarket runs unmodified while every API call pays a genuine
+network round trip.
+"""
+
+import json
+import httplib
+import urlparse
+import storymarket.exceptions
+
+class FakeAPIError(storymarket.exceptions.StorymarketError):
+    def __init__(self, status, body):
+        Exception.__init__(self, status, body)
+        self.status = status
+
+class _Resource(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+class FakeContent(_Resource):
+    def upload_blob(self, blob):
+        if hasattr(blob, 'read'):
+            blob = blob.read()
+        self._manager._request('PUT', '/%s/%s/blob/' % (self._manager.path, self.id), blob)
+
+class Manager(object):
+    def __init__(self, api, path, resource_class=_Resource):
+        self.api = api
+        self.path = path
+        self.resource_class = resource_class
+
+    def _request(self, method, url, body=None):
+        conn = httplib.HTTPConnection(self.api.host, self.api.port)
+        try:
+            conn.request(method, url, body, {'Content-Length': str(len(body or ''))})
+            response = conn.getresponse()
+            payload = response.read()
+        finally:
+            conn.close()
+        if response.status >= 400:
+            raise FakeAPIError(response.status, payload)
+        return json.loads(payload) if payload else None
+
+    def all(self):
+        return [_Resource(**o) for o in self._request('GET', '/%s/' % self.path)]
+
+    def get(self, id):
+        return _Resource(id=id, name='%s %s' % (self.path, id))
+
+    def create(self, data):
+        data = dict((k, getattr(v, 'id', v)) for (k, v) in data.items())
+        created = self._request('POST', '/%s/' % self.path, json.dumps(data))
+        return self.resource_class(
+            _manager        = self,
+            id              = created['id'],
+            tags            = created.get('tags', ''),
+            org             = _Resource(id=created.get('org')),
+            category        = _Resource(id=created.get('category')),
+            pricing_scheme  = created.get('pricing_scheme') and _Resource(id=created['pricing_scheme']),
+            rights_scheme   = created.get('rights_scheme') and _Resource(id=created['rights_scheme']),
+        )
+
+# Attribute name on the API -> the class name of the content it creates
+# (mark_synced derives the Storymarket type from the class name).
+CONTENT_MANAGERS = {
+    'audio':    'Audio',
+    'data':     'Data',
+    'photos':   'Photo',
+    'text':     'Text',
+    'video':    'Video',
+    'packages': 'Package',
+}
+
+def make_api_class(server_url):
+    """
+    Build a ``Storymarket``-alike class bound to the fake server at
+    ``server_url``.
+    """
+    parsed = urlparse.urlparse(server_url)
+
+    class FakeStorymarket(object):
+        host = parsed.hostname
+        port = parsed.port
+
+        def __init__(self, api_key):
+            self.api_key = api_key
+            for name in ('orgs', 'subcategories', 'pricing', 'rights'):
+                setattr(self, name, Manager(self, name))
+            for name, class_name in CONTENT_MANAGERS.items():
+                resource_class = type(class_name, (FakeContent,), {})
+                setattr(self, name, Manager(self, name, resource_class))
+
+    return FakeStorymarket
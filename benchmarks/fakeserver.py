@@ -0,0 +1,112 @@
+"""
+A local stand-in for the Storymarket API, for benchmarking.
+
+It speaks just enough of the API -- listing orgs/categories/pricing/rights,
+creating content, and uploading blobs -- to drive django-storymarket, with
+configurable latency, error rate, and rate limiting so benchmarks can model
+a slow or flaky Storymarket.
+"""
+
+import time
+import json
+import random
+import threading
+import itertools
+import BaseHTTPServer
+import SocketServer
+
+CONTENT_TYPES = ('audio', 'data', 'photos', 'text', 'video', 'packages')
+CHOICE_TYPES = ('orgs', 'subcategories', 'pricing', 'rights')
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body=None):
+        payload = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        server.bytes_received += len(body)
+
+        time.sleep(server.latency)
+        if not server.take_token():
+            return self._respond(429, {'error': 'rate limited'})
+        if server.error_rate and random.random() < server.error_rate:
+            return self._respond(503, {'error': 'injected failure'})
+
+        parts = [p for p in self.path.split('/') if p]
+        if self.command == 'GET' and len(parts) == 1 and parts[0] in CHOICE_TYPES:
+            return self._respond(200, [{'id': i, 'name': '%s %s' % (parts[0], i)}
+                                       for i in range(1, 6)])
+        if self.command == 'POST' and len(parts) == 1 and parts[0] in CONTENT_TYPES:
+            data = json.loads(body or '{}')
+            data['id'] = server.next_id()
+            return self._respond(201, data)
+        if self.command == 'PUT' and len(parts) == 3 and parts[2] == 'blob':
+            return self._respond(204)
+        return self._respond(404, {'error': 'not found'})
+
+    do_GET = do_POST = do_PUT = _handle
+
+class FakeStorymarketServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The fake server. Start it with :meth:`start`; it serves from a
+    background thread until :meth:`stop` is called.
+
+    :param latency: Seconds to wait before answering each request.
+    :param error_rate: Fraction (0-1) of requests answered with a 503.
+    :param rate_limit: Requests per second allowed before answering with
+                       a 429, or ``None`` for no limit.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0, error_rate=0, rate_limit=None, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.bytes_received = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit
+        self._last_refill = time.time()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address
+
+    def next_id(self):
+        with self._lock:
+            return self._ids.next()
+
+    def take_token(self):
+        """Token-bucket rate limiting; returns False if rate limited."""
+        if self.rate_limit is None:
+            return True
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.rate_limit,
+                               self._tokens + (now - self._last_refill) * self.rate_limit)
+            self._last_refill = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
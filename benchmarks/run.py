@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Benchmark django-storymarket against a local fake Storymarket server.
+
+Usage::
+
+    python benchmarks/run.py [-n 200] [--latency 0.01] [--error-rate 0]
+                             [--rate-limit 50] [--save] [--only NAME]
+
+Results are in objects per second. They're compared against the numbers
+in ``benchmarks/baseline.json`` (written with ``--save``), and anything
+more than ``--tolerance`` slower than its baseline is flagged.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from django.conf import settings
+settings.configure(
+    DATABASES = {
+        # Not :memory: -- concurrent uploads use a connection per thread.
+        'default': {'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': tempfile.mktemp(suffix='.db', prefix='storymarket-bench-')}
+    },
+    INSTALLED_APPS = ['django_storymarket', 'django.contrib.contenttypes', 'django.contrib.auth'],
+    STORYMARKET_API_KEY = 'APIKEY',
+)
+
+import mock
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.http import HttpRequest, QueryDict
+from django_storymarket import converters
+from django_storymarket.admin import upload_to_storymarket
+from django_storymarket.forms import StorymarketSyncForm
+from django_storymarket.models import AutoSyncedModel, AutoSyncRule
+from django_storymarket.utils import save_to_storymarket, bulk_save_to_storymarket
+from benchmarks.client import make_api_class
+from benchmarks.fakeserver import FakeStorymarketServer
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BLOB_SIZE = 256 * 1024
+
+def user_to_storymarket(api, obj):
+    return {
+        "type": "text",
+        "title": obj.username,
+        "author": "benchmark",
+        "org": 1,
+        "category": 1,
+        "tags": "benchmark",
+        "content": obj.email,
+    }
+
+class BenchmarkAdmin(admin.ModelAdmin):
+    def message_user(self, request, message):
+        pass
+
+#
+# The benchmarks. Each takes a batch of users to work on and returns the
+# number of objects processed; the runner feeds them batches of the size
+# listed in BENCHMARKS.
+#
+
+def bench_save_text(users):
+    for user in users:
+        data = converters.convert(user)
+        save_to_storymarket(user, data.pop('type'), data)
+    return len(users)
+
+def bench_bulk_save_text(users):
+    items = []
+    for user in users:
+        data = converters.convert(user)
+        items.append((user, data.pop('type'), data))
+    bulk_save_to_storymarket(items)
+    return len(users)
+
+def bench_save_blob(users):
+    for user in users:
+        data = converters.convert(user)
+        data.pop('type')
+        data['blob'] = 'x' * BLOB_SIZE
+        save_to_storymarket(user, 'photo', data)
+    return len(users)
+
+def bench_save_package(users):
+    # The first user is the package; the rest are photos in it.
+    package, photos = users[0], users[1:]
+    data = converters.convert(package)
+    data.pop('type')
+    data['items'] = []
+    for photo in photos:
+        item = converters.convert(photo)
+        item.update(type='photos', object=photo, blob='x' * 1024)
+        data['items'].append(item)
+    save_to_storymarket(package, 'package', data)
+    return len(users)
+
+def bench_admin_action(users):
+    modeladmin = BenchmarkAdmin(User, admin.site)
+    post = QueryDict('', mutable=True)
+    post['post'] = 'yes'
+    for user in users:
+        prefix = 'sm-%s' % user.pk
+        post.update({'%s-org' % prefix: '1', '%s-category' % prefix: '1',
+                     '%s-tags' % prefix: 'benchmark', '%s-pricing' % prefix: '1',
+                     '%s-rights' % prefix: '1'})
+    request = HttpRequest()
+    request.method = 'POST'
+    request.POST = post
+    upload_to_storymarket(modeladmin, request, User.objects.filter(pk__in=[u.pk for u in users]))
+    return len(users)
+
+def bench_should_sync(users):
+    asm = AutoSyncedModel.objects.get(content_type=ContentType.objects.get_for_model(User))
+    for user in users:
+        asm.should_sync(user)
+    return len(users)
+
+def bench_form_rendering(users):
+    for user in users:
+        StorymarketSyncForm(prefix='sm-%s' % user.pk).as_p()
+    return len(users)
+
+# (name, function, batch size)
+BENCHMARKS = [
+    ('save_text',      bench_save_text,      1),
+    ('bulk_save_text', bench_bulk_save_text, 20),
+    ('save_blob',      bench_save_blob,      1),
+    ('save_package',   bench_save_package,   3),
+    ('admin_action',   bench_admin_action,   10),
+    ('should_sync',    bench_should_sync,    100),
+    ('form_rendering', bench_form_rendering, 10),
+]
+
+def setup_database(n):
+    call_command('syncdb', interactive=False, verbosity=0)
+    users = [User.objects.create(username='user%s' % i, email='user%s@example.com' % i)
+             for i in range(n)]
+    asm = AutoSyncedModel.objects.create(content_type=ContentType.objects.get_for_model(User),
+                                         enabled=True)
+    AutoSyncRule.objects.create(sync_model=asm, include=True, field='username',
+                                op='startswith', value='user')
+    AutoSyncRule.objects.create(sync_model=asm, include=False, field='email',
+                                op='endswith', value='.invalid')
+    converters.register(User, user_to_storymarket)
+    return users
+
+def run(options):
+    server = FakeStorymarketServer(latency=options.latency,
+                                   error_rate=options.error_rate,
+                                   rate_limit=options.rate_limit).start()
+    users = setup_database(options.n)
+    results = {}
+    try:
+        with mock.patch('storymarket.Storymarket', new=make_api_class(server.url)):
+            for name, func, batch_size in BENCHMARKS:
+                if options.only and name not in options.only:
+                    continue
+                count = errors = 0
+                start = time.time()
+                for i in range(0, len(users), batch_size):
+                    try:
+                        count += func(users[i:i+batch_size])
+                    except Exception, e:
+                        errors += 1
+                        if options.verbose:
+                            print >> sys.stderr, "%s failed: %r" % (name, e)
+                elapsed = time.time() - start
+                results[name] = (count / elapsed if elapsed else 0, errors)
+    finally:
+        server.stop()
+        os.remove(settings.DATABASES['default']['NAME'])
+    return results
+
+def report(results, baseline, tolerance):
+    regressions = 0
+    for name, _, _ in BENCHMARKS:
+        if name not in results:
+            continue
+        rate, errors = results[name]
+        line = "%-16s %10.1f objs/sec" % (name, rate)
+        if errors:
+            line += "  (%d failed batches)" % errors
+        if baseline.get(name):
+            change = (rate - baseline[name]) / baseline[name]
+            line += "  (%+.0f%% vs. baseline)" % (change * 100)
+            if change < -tolerance:
+                line += "  REGRESSION"
+                regressions += 1
+        print line
+    return regressions
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('-n', type='int', default=200,
+                      help='Number of objects per benchmark.')
+    parser.add_option('--latency', type='float', default=0.005,
+                      help='Fake server latency per request, in seconds.')
+    parser.add_option('--error-rate', type='float', default=0,
+                      help='Fraction of requests the fake server fails.')
+    parser.add_option('--rate-limit', type='float', default=None,
+                      help='Requests per second the fake server allows.')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='Slowdown vs. baseline (fraction) to flag as a regression.')
+    parser.add_option('--only', action='append', default=[],
+                      help='Only run the named benchmark (repeatable).')
+    parser.add_option('--save', action='store_true', default=False,
+                      help='Save the results as the new baseline.')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+                      help='Print each failure.')
+    options, args = parser.parse_args()
+
+    results = run(options)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        baseline = json.load(open(BASELINE_FILE))
+    regressions = report(results, baseline, options.tolerance)
+
+    if options.save:
+        baseline.update((name, rate) for (name, (rate, errors)) in results.items())
+        json.dump(baseline, open(BASELINE_FILE, 'w'), indent=2, sort_keys=True)
+        print "Saved baseline to %s." % BASELINE_FILE
+
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,5 @@
 from __future__ import absolute_import
 
-import storymarket
-
 from django import template
 from django.conf import settings
 from django.contrib import admin
@@ -11,10 +9,11 @@ from django.contrib.contenttypes import generic
 from django.shortcuts import render_to_response, redirect
 from django.utils.translation import ugettext as _
 
-from . import converters
+from . import budgets, converters, syncstatus
 from .forms import StorymarketSyncForm, StorymarketOptionalSyncForm
 from .models import SyncedObject, AutoSyncedModel, AutoSyncRule
-from .utils import save_to_storymarket
+from .planning import SyncPlan
+from .utils import save_to_storymarket, bulk_save_to_storymarket, dispatch_sync
 
 # TODO: reorganize this module into public/private stuff
 
@@ -41,7 +40,8 @@ def upload_to_storymarket(modeladmin, request, queryset):
     for obj in queryset:
         converted_data = converters.convert(obj)
         storymarket_type = converted_data.pop('type')
-        form = StorymarketSyncForm(post_data, prefix='sm-%s' % obj.pk, initial=converted_data.copy())
+        form = StorymarketSyncForm(post_data, prefix='sm-%s' % obj.pk, initial=converted_data.copy(),
+                                   sync_object=obj)
         object_info[obj.pk] = {
             'object': obj,
             'form': form,
@@ -50,13 +50,14 @@ def upload_to_storymarket(modeladmin, request, queryset):
     
     if request.POST.get('post') and all(i['form'].is_valid() for i in object_info.values()):
         # The user has confirmed the uploading and has selected valid info.
-        num_uploaded = 0
+        uploads = []
         for obj in queryset:
             info = object_info[obj.pk]
             data = info['converted_data']
             data.update(info['form'].cleaned_data)
-            save_to_storymarket(obj, info['storymarket_type'], data)
-            num_uploaded += 1
+            uploads.append((obj, info['storymarket_type'], data))
+        bulk_save_to_storymarket(uploads)
+        num_uploaded = len(uploads)
             
         modeladmin.message_user(request, 
             _("Successfully uploaded %(count)d %(items)s to Storymarket.") % {
@@ -81,16 +82,41 @@ def upload_to_storymarket(modeladmin, request, queryset):
         
     return render_to_response(template_names, context_instance=context)
         
+@attrs(short_description='Estimate uploading selected %(verbose_name_plural)s to Storymarket')
+def plan_storymarket_upload(modeladmin, request, queryset):
+    """
+    Admin action to report what uploading the selected objects would
+    involve, without uploading anything.
+    """
+    plan = SyncPlan()
+    for obj in queryset:
+        plan.add(obj)
+    modeladmin.message_user(request, _("Uploading to Storymarket would mean: %s") % plan.summary())
+
 @attrs(short_description='On Storymarket?', boolean=True)
 def is_synced_to_storymarket(obj):
     """
     Admin field callback to display storymarket sync status.
     """
-    return SyncedObject.objects.for_model(obj).exists()
+    return syncstatus.get(obj) is not None
     
 # TODO: figure out how (if at all) to get converted data into form.intial
 
 class StorymarketUploaderInlineFormset(generic.BaseGenericInlineFormSet):
+    def __init__(self, *args, **kwargs):
+        super(StorymarketUploaderInlineFormset, self).__init__(*args, **kwargs)
+        
+        # Status of any sync of this object that was handed off to Celery,
+        # for display on the change page.
+        self.queued_sync = None
+        if self.instance is not None and self.instance.pk is not None:
+            self.queued_sync = budgets.get_queued_status(self.instance)
+    
+    def _construct_form(self, i, **kwargs):
+        # Offer choices from the account this object will be synced with.
+        kwargs['sync_object'] = self.instance
+        return super(StorymarketUploaderInlineFormset, self)._construct_form(i, **kwargs)
+        
     def save(self):
         # TODO: only do an update if the object already exists on SM
         
@@ -105,11 +131,18 @@ class StorymarketUploaderInlineFormset(generic.BaseGenericInlineFormSet):
             sm_data = converters.convert(self.instance)
             sm_type = sm_data.pop('type')
             sm_data.update(form.cleaned_data)
-            so, created = save_to_storymarket(self.instance, sm_type, sm_data)
-            if created:
-                self.new_objects.append(so)
-            else:
-                self.changed_objects.append(so)
+            result = dispatch_sync(self.instance, sm_type, sm_data,
+                                   budget=budgets.INLINE_BUDGET, interactive=True,
+                                   choices=form.cleaned_data)
+            
+            # A None result means the sync was queued; there's no
+            # SyncedObject to report yet.
+            if result is not None:
+                so, created = result
+                if created:
+                    self.new_objects.append(so)
+                else:
+                    self.changed_objects.append(so)
             
         return self.new_objects + self.changed_objects
 
@@ -0,0 +1,142 @@
+"""
+Bulk backfilling of existing objects to Storymarket.
+
+Each model is split into shards of up to ``shard_size`` objects by primary
+key range (cut from the actual primary keys, so gaps don't make for empty
+shards), recorded as
+:class:`~django_storymarket.models.BackfillShard` rows. Shards are
+processed independently -- by the ``storymarket_backfill`` command, across
+a pool of processes -- and checkpoint their progress as they go, so a
+backfill that's killed part-way through can simply be run again.
+
+Only models with integer primary keys can be backfilled.
+"""
+
+import logging
+import datetime
+from django.db import connection
+from django.core.cache import cache
+from django.db.models import Max
+from django.contrib.contenttypes.models import ContentType
+from . import clients, converters, history
+from .models import SyncedObject, AutoSyncedModel, BackfillShard
+from .planning import SyncPlan
+from .utils import save_to_storymarket
+
+log = logging.getLogger('django_storymarket')
+
+def plan_shards(run, model, shard_size):
+    """
+    Create the shards for backfilling ``model`` as part of ``run``, unless
+    they already exist from an earlier attempt.
+
+    Returns a list of the unfinished shards for the model.
+    """
+    ct = ContentType.objects.get_for_model(model)
+    shards = BackfillShard.objects.filter(run=run, content_type=ct)
+    if not shards.exists():
+        for start, end in shard_bounds(model, shard_size):
+            BackfillShard.objects.create(run=run, content_type=ct, start_pk=start, end_pk=end)
+    return list(shards.filter(done=False))
+
+def shard_bounds(model, shard_size):
+    """
+    Yield ``(start_pk, end_pk)`` ranges each holding ``shard_size`` of
+    ``model``'s objects (the last may hold fewer). Costs a query per shard.
+    """
+    pks = model._default_manager.order_by('pk').values_list('pk', flat=True)
+    first = list(pks[:1])
+    if not first:
+        return
+    start = first[0]
+    last = model._default_manager.aggregate(hi=Max('pk'))['hi']
+    while start is not None:
+        following = list(pks.filter(pk__gte=start)[shard_size:shard_size + 1])
+        end = following[0] if following else last + 1
+        yield start, end
+        start = following[0] if following else None
+
+def shard_queryset(shard, resync=False, autosync=False):
+    """
+    The objects remaining to be backfilled in ``shard``, in pk order.
+
+    Unless ``resync`` is True, objects that have already been synced
+    are left out. If ``autosync`` is True, only objects passing the model's
+    :class:`~django_storymarket.models.AutoSyncedModel` rules are included.
+    """
+    model = shard.content_type.model_class()
+    start = shard.start_pk if shard.last_pk is None else shard.last_pk + 1
+    qs = model._default_manager.filter(pk__gte=start, pk__lt=shard.end_pk).order_by('pk')
+    if not resync:
+        pks = [str(pk) for pk in qs.values_list('pk', flat=True)]
+        # Pending rows (an interrupted create) still need syncing.
+        synced = SyncedObject.objects.filter(content_type=shard.content_type, object_pk__in=pks,
+                                             storymarket_id__isnull=False)
+        qs = qs.exclude(pk__in=list(synced.values_list('object_pk', flat=True)))
+    if autosync:
+        try:
+            asm = AutoSyncedModel.objects.get(content_type=shard.content_type)
+        except AutoSyncedModel.DoesNotExist:
+            return qs.none()
+        qs = qs.filter(pk__in=list(asm.sync_pks(qs)))
+    return qs
+
+def process_shard(shard_id, resync=False, autosync=False):
+    """
+    Backfill every object in a shard, checkpointing after each one.
+
+    Returns the shard. Errors syncing individual objects are logged and
+    counted, not raised.
+    """
+    shard = BackfillShard.objects.select_related('content_type').get(pk=shard_id)
+    with history.batch():
+        for obj in shard_queryset(shard, resync, autosync).iterator():
+            try:
+                data = converters.convert(obj)
+                save_to_storymarket(obj, data.pop('type'), data)
+                shard.synced += 1
+            except Exception, e:
+                log.exception("Backfill of %s %s failed: %s" % (obj._meta, obj.pk, e))
+                shard.failed += 1
+            shard.last_pk = obj.pk
+            shard.last_updated = datetime.datetime.now()
+            shard.save()
+
+    shard.done = True
+    shard.last_updated = datetime.datetime.now()
+    shard.save()
+    return shard
+
+def _pool_initializer():
+    # Forked workers mustn't use (or close!) a database connection
+    # inherited from the parent; drop it so each opens its own.
+    connection.connection = None
+
+    # Nor share its cache connection (used for sync locks): with memcached
+    # the processes' requests and replies would get mixed up on the one
+    # socket. Closing the worker's copy makes it reconnect. Likewise, the
+    # API clients the parent pooled.
+    if hasattr(cache, 'close'):
+        cache.close()
+    clients._local.__dict__.clear()
+
+def _pool_process_shard(args):
+    shard_id, resync, autosync = args
+    shard = process_shard(shard_id, resync, autosync)
+    return shard.pk, shard.synced, shard.failed
+
+def plan_backfill(model, shard_size, resync=False, autosync=False, plan=None):
+    """
+    Plan backfilling ``model`` without uploading anything or recording
+    any shards. Returns a :class:`~django_storymarket.planning.SyncPlan`
+    (``plan``, if one is passed in to add to).
+    """
+    if plan is None:
+        plan = SyncPlan()
+    ct = ContentType.objects.get_for_model(model)
+    for start, end in shard_bounds(model, shard_size):
+        # An unsaved shard, just to reuse shard_queryset().
+        shard = BackfillShard(content_type=ct, start_pk=start, end_pk=end)
+        for obj in shard_queryset(shard, resync, autosync).iterator():
+            plan.add(obj)
+    return plan
@@ -0,0 +1,120 @@
+"""
+Blob handling: sizing, hashing, deduplication, preprocessing, and the
+upload itself.
+
+With ``STORYMARKET_DEDUPLICATE_BLOBS = True``, blobs are hashed (SHA-1)
+before anything is sent, and every upload is recorded in
+:class:`~django_storymarket.models.SyncedBlob`. When an object's blob has
+already been uploaded as a Storymarket item of the same type, the object is
+linked to that existing item instead of creating a new one and sending the
+same bytes again.
+"""
+
+import os
+import hashlib
+import tempfile
+from django.conf import settings
+from django.db import IntegrityError
+from . import metrics, preprocessors, retries
+from .models import SyncedBlob
+
+DEDUPLICATE_BLOBS = getattr(settings, 'STORYMARKET_DEDUPLICATE_BLOBS', False)
+
+# Read blobs this many bytes at a time while hashing.
+CHUNK_SIZE = 64 * 1024
+
+# Unseekable blobs are spooled while hashing; past this size the spool
+# goes to disk instead of memory.
+SPOOL_MAX_MEMORY = 10 * 1024 * 1024
+
+def blob_size(blob):
+    """
+    Best-effort size, in bytes, of a blob (a string or file-like object).
+
+    Returns ``None`` if the size can't be figured out without reading
+    the blob.
+    """
+    if isinstance(blob, basestring):
+        return len(blob)
+    if getattr(blob, 'size', None) is not None:
+        return blob.size
+    try:
+        return os.fstat(blob.fileno()).st_size
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+def hash_blob(blob):
+    """
+    Hash a blob, reading file-like blobs a chunk at a time.
+
+    Returns ``(content_hash, blob)``. The returned blob is ready to be
+    uploaded: it's the original blob rewound if that's possible, or a
+    spooled copy if it isn't.
+    """
+    hasher = hashlib.sha1()
+    if isinstance(blob, basestring):
+        hasher.update(blob)
+        return hasher.hexdigest(), blob
+
+    try:
+        start = blob.tell()
+        blob.seek(start)
+        spool = None
+    except (AttributeError, IOError):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+
+    for chunk in iter(lambda: blob.read(CHUNK_SIZE), ''):
+        hasher.update(chunk)
+        if spool is not None:
+            spool.write(chunk)
+
+    if spool is None:
+        blob.seek(start)
+    else:
+        spool.seek(0)
+        blob = spool
+    return hasher.hexdigest(), blob
+
+def find_uploaded(content_hash, storymarket_type):
+    """
+    Return the :class:`SyncedBlob` recording an earlier upload of the blob
+    with ``content_hash`` as a ``storymarket_type`` item, or ``None``.
+    """
+    try:
+        return SyncedBlob.objects.get(content_hash=content_hash,
+                                      storymarket_type=_normalize_type(storymarket_type))
+    except SyncedBlob.DoesNotExist:
+        return None
+
+def upload(sm_obj, blob, content_hash=None, **tags):
+    """
+    Upload ``blob`` to the Storymarket item ``sm_obj``, recording the upload
+    against ``content_hash`` if given. ``tags`` are passed along to metrics.
+    
+    The blob is run through any preprocessor configured for the item's
+    type first; see :mod:`django_storymarket.preprocessors`.
+    """
+    storymarket_type = sm_obj.__class__.__name__.lower()
+    if preprocessors.get_preprocessor(storymarket_type):
+        with metrics.timer('preprocess_blob', **tags):
+            blob = preprocessors.preprocess(storymarket_type, blob, content_hash)
+    
+    size = blob_size(blob)
+    with metrics.timer('upload_blob', bytes=size, **tags) as upload_tags:
+        retries.upload_blob(sm_obj, blob, upload_tags)
+
+    if content_hash:
+        try:
+            SyncedBlob.objects.create(
+                content_hash     = content_hash,
+                storymarket_type = storymarket_type,
+                storymarket_id   = sm_obj.id,
+                size             = size,
+            )
+        except IntegrityError:
+            # Another upload of the same blob beat us to it; either is fine.
+            pass
+
+def _normalize_type(storymarket_type):
+    # "photos" and "photo" are the same thing; stored types are singular.
+    return storymarket_type.rstrip('s')
@@ -0,0 +1,97 @@
+"""
+Latency budgets: deciding whether a sync can run inline or should be
+handed off to Celery.
+
+Syncs from the admin inline run inside the save request, so a slow
+Storymarket blocks the editor's save button. With
+``STORYMARKET_INLINE_BUDGET`` set (in seconds), the inline estimates how
+long a sync will take from recent API latency, runs it inline if it fits,
+and queues it otherwise. Queued syncs are tracked in the cache so the change
+page can show their status.
+
+Only makes sense with ``STORYMARKET_QUEUE_UPLOADS`` on; without Celery
+everything runs inline.
+"""
+
+import datetime
+from django.conf import settings
+from django.core.cache import cache
+from .signals import sync_stage_finished
+
+INLINE_BUDGET = getattr(settings, 'STORYMARKET_INLINE_BUDGET', None)
+
+# What to assume an API create costs (in seconds) before we've measured any.
+DEFAULT_API_LATENCY = getattr(settings, 'STORYMARKET_DEFAULT_API_LATENCY', 1.0)
+
+# Weight given to each new latency sample in the moving average.
+LATENCY_SMOOTHING = 0.2
+
+# How long queued-sync status hangs around, in seconds.
+STATUS_TIMEOUT = 24 * 60 * 60
+
+LATENCY_CACHE_KEY = 'storymarket_api_latency'
+
+def api_latency():
+    """
+    The recent average time (in seconds) of a Storymarket create call.
+    """
+    latency = cache.get(LATENCY_CACHE_KEY)
+    return DEFAULT_API_LATENCY if latency is None else latency
+
+def record_api_latency(sender, stage, duration, tags, **kwargs):
+    """
+    Signal receiver folding each create call's duration into the moving
+    average. Not perfectly accurate under concurrency, but close enough.
+    Retried calls are skipped; their durations are mostly backoff.
+    """
+    if stage != 'create' or tags.get('failed') or tags.get('retries'):
+        return
+    latency = cache.get(LATENCY_CACHE_KEY)
+    if latency is not None:
+        duration = latency + LATENCY_SMOOTHING * (duration - latency)
+    cache.set(LATENCY_CACHE_KEY, duration, STATUS_TIMEOUT)
+
+sync_stage_finished.connect(record_api_latency)
+
+def estimate_duration(storymarket_type, data):
+    """
+    Estimate how long (in seconds) syncing ``data`` will take inline.
+
+    Blobs don't count: with uploads queued they never run inline anyway.
+    """
+    api_calls = 1
+    if storymarket_type == 'package':
+        api_calls += len(data.get('items', []))
+    return api_calls * api_latency()
+
+def fits_budget(storymarket_type, data, budget):
+    """
+    Should a sync with the given ``budget`` (in seconds, or ``None`` for
+    no limit) run inline?
+    """
+    if budget is None:
+        return True
+    return estimate_duration(storymarket_type, data) <= budget
+
+#
+# Status of queued syncs.
+#
+
+def _status_key(obj):
+    return 'storymarket_queued_sync:%s:%s' % (obj._meta, obj.pk)
+
+def get_queued_status(obj):
+    """
+    Return the status of a queued sync of ``obj`` as a dict with ``state``
+    (``"queued"`` or ``"failed"``), ``since`` (a datetime), and ``error``
+    (a message, if it failed) -- or ``None`` if no sync is queued.
+    """
+    return cache.get(_status_key(obj))
+
+def set_queued_status(obj, state, error=None):
+    cache.set(_status_key(obj),
+              {'state': state, 'since': datetime.datetime.now(), 'error': error},
+              STATUS_TIMEOUT)
+
+def clear_queued_status(obj):
+    cache.delete(_status_key(obj))
@@ -0,0 +1,161 @@
+"""
+Storymarket API clients, pooled per account.
+
+By default there's a single account, using ``STORYMARKET_API_KEY``. To sync
+to several Storymarket accounts, list them in ``STORYMARKET_ACCOUNTS``::
+
+    STORYMARKET_ACCOUNTS = {
+        'journal-world': {'api_key': '...', 'rate_limit': 10},
+        'lawrence-com':  {'api_key': '...', 'org': 12},
+    }
+
+and point ``STORYMARKET_ACCOUNT_ROUTER`` at a function taking a model
+instance and returning the name of the account it belongs to (or ``None``
+for the default account)::
+
+    def route_by_site(instance):
+        return instance.site.domain
+
+Each account gets its own API clients (one per thread, reused across
+calls), its own rate limit -- ``rate_limit`` requests per second, or the
+default account's ``STORYMARKET_RATE_LIMIT`` -- and its own namespace in
+the cache of org/category/etc. choices. ``org`` (``STORYMARKET_ORG`` for
+the default account) is the ID of the account's Storymarket org; see
+:mod:`django_storymarket.reconcile`.
+"""
+
+import time
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+DEFAULT_ACCOUNT = 'default'
+
+_router = None
+def get_router():
+    global _router
+    if _router is None:
+        path = getattr(settings, 'STORYMARKET_ACCOUNT_ROUTER', None)
+        if path:
+            module_name, func_name = path.rsplit('.', 1)
+            _router = getattr(import_module(module_name), func_name)
+        else:
+            _router = lambda instance: None
+    return _router
+
+def account_for(instance):
+    """
+    The name of the account ``instance`` should be synced with.
+    """
+    if instance is None:
+        return DEFAULT_ACCOUNT
+    return get_router()(instance) or DEFAULT_ACCOUNT
+
+def accounts():
+    """
+    A dict of all configured accounts, by name.
+    """
+    all_accounts = dict(getattr(settings, 'STORYMARKET_ACCOUNTS', {}))
+    all_accounts.setdefault(DEFAULT_ACCOUNT, {
+        'api_key': getattr(settings, 'STORYMARKET_API_KEY', None),
+        'rate_limit': getattr(settings, 'STORYMARKET_RATE_LIMIT', None),
+        'org': getattr(settings, 'STORYMARKET_ORG', None),
+    })
+    return all_accounts
+
+def get_account(name):
+    try:
+        return accounts()[name]
+    except KeyError:
+        raise ImproperlyConfigured("Unknown Storymarket account: %r" % name)
+
+_local = threading.local()
+def get_api(instance=None, account=None):
+    """
+    Return a Storymarket API client for ``account`` -- or, if that's not
+    given, for the account ``instance`` routes to.
+
+    Clients are pooled per account and thread. They're keyed on
+    ``storymarket.Storymarket`` too, so patching it (as the tests do)
+    takes effect immediately.
+    """
+    # Imported here so that just importing django_storymarket doesn't.
+    import storymarket
+    
+    if account is None:
+        account = account_for(instance)
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = {}
+
+    pool_key = (storymarket.Storymarket, account)
+    if pool_key not in pool:
+        config = get_account(account)
+        api = storymarket.Storymarket(config['api_key'])
+        if config.get('rate_limit'):
+            api = _ThrottledAPI(api, _get_bucket(account, config['rate_limit']))
+        pool[pool_key] = api
+    return pool[pool_key]
+
+#
+# Rate limiting.
+#
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket allowing ``rate`` operations per second
+    (with bursts of up to ``rate``). :meth:`take` blocks until there's
+    a token.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+def _get_bucket(account, rate):
+    with _buckets_lock:
+        if account not in _buckets:
+            _buckets[account] = TokenBucket(rate)
+        return _buckets[account]
+
+class _ThrottledAPI(object):
+    """
+    Wraps an API client so that every manager method call (``create()``,
+    ``all()``, ...) takes a token from the account's bucket first.
+    """
+    def __init__(self, api, bucket):
+        self._api = api
+        self._bucket = bucket
+
+    def __getattr__(self, name):
+        return _ThrottledManager(getattr(self._api, name), self._bucket)
+
+class _ThrottledManager(object):
+    def __init__(self, manager, bucket):
+        self._manager = manager
+        self._bucket = bucket
+
+    def __getattr__(self, name):
+        attr = getattr(self._manager, name)
+        if not callable(attr):
+            return attr
+        def throttled(*args, **kwargs):
+            self._bucket.take()
+            return attr(*args, **kwargs)
+        return throttled
@@ -31,45 +31,219 @@ either be the binary data as a string or (more likely) a file-like object::
         }
 """
 
-import storymarket
+import os
+import sys
+import time
+import zlib
+import hashlib
+import cPickle
+import threading
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
 from django.utils.importlib import import_module
 from django.utils.module_loading import module_has_submodule
+from . import clients
+from . import metrics
+from . import profiling
 
 _registry = {}
 _FALLBACK_KEY = '*'
 _CONVERTER_MODULE_NAME = 'storymarket_converters'
 
+# How long (in seconds) converted data is cached; 0 (the default) turns
+# caching off. Cached conversions are only invalidated when the object itself
+# is saved, so don't turn this on for converters that use related objects or
+# data changed by QuerySet.update().
+CONVERT_CACHE_TIMEOUT = getattr(settings, 'STORYMARKET_CONVERT_CACHE_TIMEOUT', 0)
+
+# Optionally, a field per model ("app_label.modelname": "field") whose value
+# changes whenever the object does -- a modified timestamp, say -- to
+# include in conversion cache keys.
+CONVERT_VERSION_FIELDS = getattr(settings, 'STORYMARKET_CONVERT_VERSION_FIELDS', {})
+
+# The converter modules autodiscover() should import, skipping the search
+# of every installed app. Without this, what the search finds is cached (for
+# this many seconds; 0 turns it off) under a hash of INSTALLED_APPS and their
+# directories' modification times, so only the first process to start has to
+# search -- until a converter module is added to (or removed from) an app.
+CONVERTER_MODULES = getattr(settings, 'STORYMARKET_CONVERTER_MODULES', None)
+DISCOVERY_CACHE_TIMEOUT = getattr(settings, 'STORYMARKET_DISCOVERY_CACHE_TIMEOUT', 60 * 60)
+
+# Lookup tables derived from _registry. They're built on first use and
+# thrown away whenever the registry changes. _dispatch maps model classes to
+# converters; subclasses and proxies are added to it as they're first seen.
+_dispatch = None
+_registered_models = None
+_registered_ct_ids = None
+
 def convert(instance):
     """
     Convert a model instance using its registered converter.
     
     If it fails, this'll raise :exc:`CannotConvert`.
     
+    If ``STORYMARKET_CONVERT_CACHE_TIMEOUT`` is set, results are cached for
+    that many seconds, until the instance is next saved, so the admin's confirmation page,
+    the upload itself, and background syncs don't all re-run expensive
+    converters. Each call returns a fresh copy, so callers may modify it.
+    
     :param instance: The model instance to convert.
     :rtype: dict
     """
-    autodiscover()
-    api = storymarket.Storymarket(settings.STORYMARKET_API_KEY)
+    converter = get_converter(instance.__class__)
+    if converter is None:
+        raise CannotConvert("Can't convert %s objects." % instance._meta)
     
-    # I'm using look-before-you-leap instead of better-to-ask-for-permission
-    # here because a try/except might accidentally catch a KeyError raised
-    # by the converter itself.
     registry_key = str(instance._meta)
-    if registry_key in _registry:
-        return _registry[registry_key](api, instance)
-    elif _FALLBACK_KEY in _registry:
-        return _registry[_FALLBACK_KEY](api, instance)
+    cache_key = _conversion_cache_key(instance) if CONVERT_CACHE_TIMEOUT else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            metrics.get_backend().incr('storymarket.convert.cache_hits', tags={'model': registry_key})
+            return cPickle.loads(zlib.decompress(cached))
+    
+    api = clients.get_api(instance)
+    with metrics.timer('convert', model=registry_key) as tags:
+        if profiling.ENABLED:
+            data = profiling.profile(registry_key, converter, api, instance)
+        else:
+            data = converter(api, instance)
+        tags['storymarket_type'] = data.get('type')
+    
+    if cache_key and _cacheable(data):
+        try:
+            packed = zlib.compress(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+        except Exception:
+            # Not everything converters return can be pickled; that just
+            # means it won't be cached.
+            pass
+        else:
+            cache.set(cache_key, packed, CONVERT_CACHE_TIMEOUT)
+    return data
+
+def _conversion_cache_key(instance):
+    """
+    The cache key for a converted instance, or ``None`` if it can't be
+    cached. The key includes the instance's version field (if one's
+    configured for the model) and a token that changes on every save.
+    """
+    if instance.pk is None:
+        return None
+    model_key = str(instance._meta)
+    version = ''
+    field = CONVERT_VERSION_FIELDS.get(model_key)
+    if field:
+        version = getattr(instance, field, '')
+    token = cache.get(_save_token_key(model_key, instance.pk)) or '0'
+    return 'storymarket_convert:%s:%s:%s:%s' % (model_key, instance.pk, version, token)
+
+def _save_token_key(model_key, pk):
+    return 'storymarket_convert_token:%s:%s' % (model_key, pk)
+
+def _cacheable(data):
+    """
+    Converted data can be cached unless it contains a file-like blob,
+    which wouldn't survive the trip (even if it can be pickled).
+    """
+    if not isinstance(data.get('blob', ''), basestring):
+        return False
+    return all(_cacheable(item) for item in data.get('items', []))
+
+def invalidate_conversion(sender, instance, **kwargs):
+    """
+    ``post_save`` handler making sure saved objects are converted afresh.
+    
+    Rather than finding and deleting cached conversions, this changes the
+    object's save token, which is part of the cache key. The token has the
+    same timeout as conversions, so it can't expire while a conversion
+    made under an older token is still around.
+    
+    Models with only the fallback converter are skipped: this runs on every
+    save of every model, and those are rarely synced.
+    """
+    if not CONVERT_CACHE_TIMEOUT or sender._meta.app_label == 'django_storymarket':
+        return
+    if not has_registered_converter(sender):
+        return
+    token = '%.6f' % time.time()
+    cache.set(_save_token_key(str(instance._meta), instance.pk), token, CONVERT_CACHE_TIMEOUT)
+
+models.signals.post_save.connect(invalidate_conversion, dispatch_uid='storymarket_invalidate_conversion')
+
+def get_converter(model):
+    """
+    Return the converter for a model class, or ``None`` if there isn't one.
+    
+    Subclasses and proxies of a registered model use its converter unless
+    they've got one of their own; anything else gets the fallback converter.
+    """
+    dispatch = _dispatch if _dispatch is not None else _build()
+    
+    # Models that can't be converted are stored as None, so this has to be
+    # look-before-you-leap rather than dispatch.get().
+    if model in dispatch:
+        return dispatch[model]
+    registered = _registered_models or ()
+    for base in model.__mro__[1:]:
+        if base in registered:
+            converter = dispatch[base]
+            break
     else:
-        raise CannotConvert("Can't convert %s objects." % instance._meta)
+        converter = _registry.get(_FALLBACK_KEY)
+    dispatch[model] = converter
+    return converter
 
 def registered_models():
     """
     Return a list of all models registered for conversion.
     """
+    if _dispatch is None:
+        _build()
+    return list(_registered_models)
+
+def has_registered_converter(model):
+    """
+    Does ``model`` (or a model it inherits from) have a converter of its
+    own, rather than just the fallback converter?
+    """
+    registered = registered_models()
+    return any(base in registered for base in model.__mro__)
+
+def registered_content_type_ids():
+    """
+    Return a list of the content type IDs of all models registered for
+    conversion. Used to limit the choices in the autosync admin.
+    """
+    global _registered_ct_ids
+    if _dispatch is None:
+        _build()
+    if _registered_ct_ids is None:
+        _registered_ct_ids = [ContentType.objects.get_for_model(m).id for m in _registered_models]
+    return _registered_ct_ids
+
+def _build():
+    """
+    Build the lookup tables from the registry and return the dispatch table.
+    """
+    global _dispatch, _registered_models, _registered_ct_ids
     autodiscover()
-    return filter(None, (models.get_model(*k.split('.')) for k in _registry.keys()))
+    dispatch = {}
+    for key, callback in _registry.items():
+        if key == _FALLBACK_KEY:
+            continue
+        model = models.get_model(*key.split('.'))
+        if model is not None:
+            dispatch[model] = callback
+    _registered_models = dispatch.keys()
+    _registered_ct_ids = None
+    _dispatch = dispatch
+    return dispatch
+
+def _invalidate():
+    global _dispatch, _registered_models, _registered_ct_ids
+    _dispatch = _registered_models = _registered_ct_ids = None
 
 class CannotConvert(Exception):
     pass
@@ -82,6 +256,7 @@ def register(model, callback):
     :param callback: The conversion function.
     """
     _registry[str(model._meta)] = callback
+    _invalidate()
 
 def register_fallback_converter(callback):
     """
@@ -93,6 +268,7 @@ def register_fallback_converter(callback):
     :param callback: The conversion function.
     """
     _registry[_FALLBACK_KEY] = callback
+    _invalidate()
 
 def unregister(model):
     """
@@ -104,6 +280,7 @@ def unregister(model):
         del _registry[str(model._meta)]
     except KeyError:
         pass
+    _invalidate()
 
 def unregister_fallback_converter():
     """
@@ -113,25 +290,73 @@ def unregister_fallback_converter():
         del _registry[_FALLBACK_KEY]
     except KeyError:
         pass
+    _invalidate()
 
 _discovery_done = False
+_discovery_lock = threading.RLock()
 def autodiscover():
     """
     Auto-discover converter modules from settings.INSTALLED_APPS.
     
+    Called when a converter is first needed. Call it at startup instead --
+    from your URLconf, next to ``admin.autodiscover()`` -- to keep it out of
+    the first request that converts something.
+    
     This code is cribbed from admin.autodiscover.
     """
     global _discovery_done
     if _discovery_done: return
     
+    with _discovery_lock:
+        if _discovery_done: return
+        
+        modules = CONVERTER_MODULES
+        if modules is None and DISCOVERY_CACHE_TIMEOUT:
+            modules = cache.get(_snapshot_key())
+        try:
+            for name in modules or []:
+                import_module(name)
+        except ImportError:
+            # A stale snapshot; search again.
+            modules = None
+        
+        if modules is None:
+            modules = _find_converter_modules()
+            if DISCOVERY_CACHE_TIMEOUT:
+                cache.set(_snapshot_key(), modules, DISCOVERY_CACHE_TIMEOUT)
+        
+        _discovery_done = True
+
+def _find_converter_modules():
+    """
+    Import the converter module of every app that has one, returning their
+    names.
+    """
+    found = []
     for app in settings.INSTALLED_APPS:
         mod = import_module(app)
+        name = "%s.%s" % (app, _CONVERTER_MODULE_NAME)
         try:
-            import_module("%s.%s" % (app, _CONVERTER_MODULE_NAME))
+            import_module(name)
         except:
             # Ignore the error if the app just doesn't have a converter
             # module, but bubble it up if it was anything else.
             if module_has_submodule(mod, _CONVERTER_MODULE_NAME):
                 raise
-                
-    _discovery_done = True
\ No newline at end of file
+        else:
+            found.append(name)
+    return found
+
+def _snapshot_key():
+    # Adding or removing an app's converter module touches the app's
+    # directory, so including the directories' mtimes keeps a snapshot from
+    # hiding a new module (or listing a deleted one) after a deploy.
+    parts = []
+    for app in settings.INSTALLED_APPS:
+        try:
+            path = os.path.dirname(sys.modules[app].__file__)
+            parts.append('%s:%s' % (app, os.stat(path).st_mtime))
+        except (KeyError, AttributeError, OSError):
+            parts.append(app)
+    apps = hashlib.md5('\n'.join(parts)).hexdigest()
+    return 'storymarket_converter_modules:%s' % apps
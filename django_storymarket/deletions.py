@@ -0,0 +1,116 @@
+"""
+Propagation of deletions to Storymarket.
+
+Deleting a synced object only records a
+:class:`~django_storymarket.models.SyncTombstone` (see
+:func:`~django_storymarket.models.record_deletion`), which keeps deletes --
+even mass deletes -- fast. :func:`propagate_deletions` then works through
+the tombstones in batches: it deletes the Storymarket items, concurrently,
+and cleans up the local bookkeeping in bulk. An item that some other,
+undeleted object is also synced to is left alone.
+
+Run it periodically with the ``storymarket_propagate_deletions`` command or
+the ``propagate_deletions_task`` Celery task.
+"""
+
+import logging
+from . import clients, retries
+from .models import SyncedObject, SyncedBlob, SyncTombstone
+from .utils import get_manager, run_concurrently
+
+log = logging.getLogger('django_storymarket')
+
+def propagate_deletions(batch_size=500):
+    """
+    Delete the Storymarket items of deleted objects, and the local records
+    of them.
+
+    Tombstones whose items couldn't be deleted are kept to be retried next
+    time. Returns ``(deleted, failed)`` counts of Storymarket items.
+    """
+    total_deleted = total_failed = 0
+    last_pk = 0
+
+    while True:
+        tombstones = list(SyncTombstone.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not tombstones:
+            break
+        last_pk = tombstones[-1].pk
+
+        # Look up the synced records for the whole batch, a query per model.
+        by_type = {}
+        for t in tombstones:
+            by_type.setdefault(t.content_type_id, []).append(t.object_pk)
+        synced = []
+        for ct_id, pks in by_type.items():
+            synced.extend(SyncedObject.objects.filter(content_type=ct_id, object_pk__in=pks))
+
+        # Items still synced to objects that aren't being deleted stay put;
+        # the rest are deleted once each, from the account they were
+        # synced with.
+        shared = _shared_items(synced)
+        items = {}
+        for so in synced:
+            item = (so.storymarket_type, so.storymarket_id)
+            if item not in shared:
+                items.setdefault(item, so)
+        results = dict(zip(items.keys(), run_concurrently(
+            _delete_remote, [(so,) for so in items.values()])))
+
+        gone = dict((so.pk, results.get((so.storymarket_type, so.storymarket_id), True)) for so in synced)
+        deleted = [so for so in synced if gone[so.pk]]
+        failed = set((so.content_type_id, so.object_pk) for so in synced if not gone[so.pk])
+
+        for (storymarket_type, storymarket_id), so in items.items():
+            if results[storymarket_type, storymarket_id] and so.account == clients.DEFAULT_ACCOUNT:
+                SyncedBlob.objects.filter(storymarket_type=storymarket_type,
+                                          storymarket_id=storymarket_id).delete()
+        SyncedObject.objects.filter(pk__in=[so.pk for so in deleted]).delete()
+        SyncTombstone.objects.filter(pk__in=[t.pk for t in tombstones
+                                             if (t.content_type_id, t.object_pk) not in failed]).delete()
+
+        total_deleted += len([ok for ok in results.values() if ok])
+        total_failed += len([ok for ok in results.values() if not ok])
+
+    return total_deleted, total_failed
+
+def _shared_items(synced):
+    """
+    The ``(storymarket_type, storymarket_id)`` items of the ``synced``
+    records that other records are synced to as well, a query per type.
+    """
+    by_type = {}
+    for so in synced:
+        if so.storymarket_id is not None:
+            by_type.setdefault(so.storymarket_type, []).append(so.storymarket_id)
+    pks = [so.pk for so in synced]
+    shared = set()
+    for storymarket_type, ids in by_type.items():
+        others = SyncedObject.objects.filter(storymarket_type=storymarket_type, storymarket_id__in=ids)
+        shared.update(others.exclude(pk__in=pks).values_list('storymarket_type', 'storymarket_id'))
+    return shared
+
+def _delete_remote(synced_object):
+    """
+    Delete a single Storymarket item, with retries. Returns ``True`` if
+    it's gone -- or can't be deleted through the API at all.
+    """
+    if synced_object.storymarket_id is None:
+        # Never (knowingly) created.
+        return True
+    # Clients aren't thread-safe, so get this thread's.
+    api = clients.get_api(account=synced_object.account)
+    try:
+        delete = get_manager(api, synced_object.storymarket_type).delete
+    except (ValueError, AttributeError):
+        log.warning("Storymarket can't delete %s items; leaving %s there." % (
+            synced_object.storymarket_type, synced_object))
+        return True
+    try:
+        retries.call(delete, (synced_object.storymarket_id,))
+    except Exception, e:
+        if (getattr(e, 'code', None) or getattr(e, 'status', None)) == 404:
+            return True
+        log.exception("Couldn't delete %s from Storymarket: %s" % (synced_object, e))
+        return False
+    return True
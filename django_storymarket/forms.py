@@ -1,9 +1,8 @@
 import logging
 import operator
-import storymarket
 from django import forms
 from django.core.cache import cache
-from django.conf import settings
+from . import clients
 from .models import SyncedObject
 
 # Timeout for choices cached from Storymarket. 5 minutes.
@@ -14,12 +13,16 @@ log = logging.getLogger('django_storymarket')
 class StorymarketSyncForm(forms.ModelForm):
     """
     A form allowing the choice of sync options for a given model instance.
+    
+    Pass the object being synced as ``sync_object`` so that the choices
+    come from the Storymarket account it'll be synced with.
     """    
     class Meta:
         model = SyncedObject
         fields = ['org', 'category', 'tags', 'pricing', 'rights']
         
     def __init__(self, *args, **kwargs):
+        self.account = clients.account_for(kwargs.pop('sync_object', None))
         super(StorymarketSyncForm, self).__init__(*args, **kwargs)
         
         # Override some fields. Tags is left alone; the default is fine.
@@ -43,7 +46,9 @@ class StorymarketSyncForm(forms.ModelForm):
         These choices are cached to save API hits, sorted, and an empty
         choice is included.
         """
-        cache_key = 'storymarket_choice_cache:%s' % manager_name
+        import storymarket.exceptions
+        
+        cache_key = 'storymarket_choice_cache:%s:%s' % (self.account, manager_name)
         choices = cache.get(cache_key)
         if choices is None:
             manager = getattr(self._api, manager_name)
@@ -65,7 +70,7 @@ class StorymarketSyncForm(forms.ModelForm):
         
     @property
     def _api(self):
-        return storymarket.Storymarket(settings.STORYMARKET_API_KEY)
+        return clients.get_api(account=self.account)
         
 class StorymarketOptionalSyncForm(StorymarketSyncForm):
     """
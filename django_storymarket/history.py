@@ -0,0 +1,232 @@
+"""
+A history of sync attempts.
+
+Every call to :func:`~django_storymarket.utils.save_to_storymarket` is
+logged as a :class:`~django_storymarket.models.SyncAttempt`: when, how long
+it took, how many bytes of blob it carried, and whether it failed. The log
+lives in its own append-only table, so the hot ``SyncedObject`` table
+isn't touched.
+
+To keep this cheap at volume, attempts are buffered and written with a
+single ``executemany()`` per :data:`HISTORY_BATCH_SIZE` rows. Outside of a
+:func:`batch` (as used by bulk uploads and backfills) each attempt is
+written straight away. Buffers and batches are per thread, so each thread
+writes its own attempts, on its own connection.
+
+Attempts are written in the current transaction (and committed only if
+there's no managed one). So when a managed transaction is rolled back --
+as ``TransactionMiddleware`` does when an admin upload fails -- the
+attempt, failure and all, goes with it. Failures in the admin are only
+logged without ``TransactionMiddleware`` (or with the sync run outside
+the request's transaction, e.g. queued to Celery).
+
+:func:`prune` rolls up each complete day into per-model
+:class:`~django_storymarket.models.SyncRollup` totals and then deletes
+attempts older than ``STORYMARKET_HISTORY_DAYS``. Run it daily with the
+``storymarket_sync_history --prune`` command or the ``prune_history_task``
+Celery task. :func:`model_stats` reports throughput and error rates from
+the rollups and recent attempts.
+"""
+
+import atexit
+import datetime
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum, Max, Min
+from django.contrib.contenttypes.models import ContentType
+from .models import SyncAttempt, SyncRollup
+
+HISTORY_ENABLED = getattr(settings, 'STORYMARKET_SYNC_HISTORY', True)
+
+# How many days of individual attempts to keep. Rollups are kept forever.
+HISTORY_DAYS = getattr(settings, 'STORYMARKET_HISTORY_DAYS', 30)
+
+# How many attempts to buffer (within a batch) before writing them.
+HISTORY_BATCH_SIZE = getattr(settings, 'STORYMARKET_HISTORY_BATCH_SIZE', 500)
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# Columns written for each attempt, in the order of the rows in the buffer.
+_COLUMNS = ('content_type', 'object_pk', 'storymarket_type', 'started',
+            'duration', 'bytes', 'succeeded', 'error')
+
+# This thread's buffered rows and batch() nesting depth.
+_local = threading.local()
+
+def _buffer():
+    if not hasattr(_local, 'buffer'):
+        _local.buffer = []
+        _local.batch_depth = 0
+    return _local.buffer
+
+def record(obj, storymarket_type, started, duration, bytes=None, error=None):
+    """
+    Log an attempt to sync ``obj``.
+
+    :param started: When the attempt started (a datetime).
+    :param duration: How long it took, in seconds.
+    :param bytes: The size of the blob uploaded, if any.
+    :param error: A message, if the attempt failed.
+    """
+    if not HISTORY_ENABLED:
+        return
+    ct = ContentType.objects.get_for_model(obj)
+    row = (ct.id, unicode(obj.pk), storymarket_type, started, duration, bytes,
+           error is None, (error or '')[:200])
+    buffer = _buffer()
+    buffer.append(row)
+    if len(buffer) >= HISTORY_BATCH_SIZE or not _local.batch_depth:
+        flush()
+
+def flush():
+    """
+    Write out this thread's buffered attempts.
+    """
+    buffer = _buffer()
+    rows = buffer[:]
+    del buffer[:]
+    if not rows:
+        return
+
+    opts = SyncAttempt._meta
+    fields = [opts.get_field(name) for name in _COLUMNS]
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(opts.db_table),
+        ', '.join(qn(f.column) for f in fields),
+        ', '.join(['%s'] * len(fields)))
+    params = [[f.get_db_prep_save(value, connection=connection) for (f, value) in zip(fields, row)]
+              for row in rows]
+    cursor = connection.cursor()
+    cursor.executemany(sql, params)
+    transaction.commit_unless_managed()
+
+atexit.register(flush)
+
+@contextmanager
+def batch():
+    """
+    Buffer attempts logged by this thread inside the block, writing them
+    in bulk; whatever's left is written when the outermost ``batch()``
+    exits.
+    """
+    _buffer()
+    _local.batch_depth += 1
+    try:
+        yield
+    finally:
+        _local.batch_depth -= 1
+        if not _local.batch_depth:
+            flush()
+
+#
+# Retention and rollups.
+#
+
+def _totals(attempts):
+    """
+    Per-model ``[attempts, failures, total_duration, bytes]`` for a queryset
+    of attempts, keyed by content type ID.
+    """
+    totals = {}
+    rows = attempts.values('content_type').annotate(
+        attempts=Count('id'), total_duration=Sum('duration'), bytes=Sum('bytes'))
+    for row in rows:
+        totals[row['content_type']] = [row['attempts'], 0, row['total_duration'] or 0, row['bytes'] or 0]
+    failures = attempts.filter(succeeded=False).values_list('content_type').annotate(Count('id'))
+    for ct_id, count in failures:
+        totals[ct_id][1] = count
+    return totals
+
+def _day_start(day):
+    return datetime.datetime.combine(day, datetime.time())
+
+def rollup(day):
+    """
+    (Re)compute the :class:`SyncRollup` rows for a single ``day``.
+    """
+    start = _day_start(day)
+    attempts = SyncAttempt.objects.filter(started__gte=start, started__lt=start + ONE_DAY)
+    SyncRollup.objects.filter(day=day).delete()
+    for ct_id, (count, failures, duration, bytes) in _totals(attempts).items():
+        SyncRollup.objects.create(day=day, content_type_id=ct_id, attempts=count,
+                                  failures=failures, total_duration=duration, bytes=bytes)
+
+def prune(days=None):
+    """
+    Roll up every complete day that hasn't been yet, then delete attempts
+    older than ``days`` (default: ``STORYMARKET_HISTORY_DAYS``).
+
+    Returns ``(days_rolled_up, attempts_deleted)``.
+    """
+    if days is None:
+        days = HISTORY_DAYS
+    flush()
+    today = datetime.date.today()
+
+    rolled_up = 0
+    first = SyncAttempt.objects.aggregate(first=Min('started'))['first']
+    if first is not None:
+        day = first.date()
+        last_rollup = SyncRollup.objects.aggregate(last=Max('day'))['last']
+        if last_rollup is not None:
+            day = max(day, last_rollup + ONE_DAY)
+        while day < today:
+            rollup(day)
+            rolled_up += 1
+            day += ONE_DAY
+
+    # A single DELETE; going through the ORM would load every row first.
+    opts = SyncAttempt._meta
+    qn = connection.ops.quote_name
+    cutoff = _day_start(today - datetime.timedelta(days=days))
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE %s < %%s" % (qn(opts.db_table), qn(opts.get_field('started').column)),
+                   [opts.get_field('started').get_db_prep_save(cutoff, connection=connection)])
+    transaction.commit_unless_managed()
+    return rolled_up, cursor.rowcount
+
+def model_stats(since):
+    """
+    Sync throughput and error rates per model from the date ``since`` up to
+    now, from the rollups plus any attempts not yet rolled up.
+
+    :rtype: A list of dicts with ``model`` (a ``ContentType``),
+            ``attempts``, ``failures``, ``error_rate``, ``per_day``
+            (attempts per day), ``mean_duration`` and ``bytes``, busiest
+            model first.
+    """
+    flush()
+    totals = {}
+    def add(ct_id, counts):
+        current = totals.setdefault(ct_id, [0, 0, 0, 0])
+        for i, value in enumerate(counts):
+            current[i] += value
+
+    rollups = SyncRollup.objects.filter(day__gte=since)
+    for r in rollups.values_list('content_type', 'attempts', 'failures', 'total_duration', 'bytes'):
+        add(r[0], r[1:])
+
+    recent_since = since
+    last_rollup = SyncRollup.objects.aggregate(last=Max('day'))['last']
+    if last_rollup is not None:
+        recent_since = max(since, last_rollup + ONE_DAY)
+    for ct_id, counts in _totals(SyncAttempt.objects.filter(started__gte=_day_start(recent_since))).items():
+        add(ct_id, counts)
+
+    num_days = (datetime.date.today() - since).days + 1
+    stats = []
+    for ct_id, (attempts, failures, duration, bytes) in totals.items():
+        stats.append({
+            'model': ContentType.objects.get_for_id(ct_id),
+            'attempts': attempts,
+            'failures': failures,
+            'error_rate': float(failures) / attempts if attempts else 0,
+            'per_day': float(attempts) / num_days,
+            'mean_duration': duration / attempts if attempts else 0,
+            'bytes': bytes,
+        })
+    stats.sort(key=lambda s: s['attempts'], reverse=True)
+    return stats
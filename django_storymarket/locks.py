@@ -0,0 +1,80 @@
+"""
+Per-object locks that keep two concurrent syncs of the same Django object
+from both creating a Storymarket item.
+
+The lock lives in the Django cache, so it's shared across processes as long
+as the cache backend is (memcached, database, etc.). ``cache.add()`` is used
+to take the lock since it's atomic on every shared backend.
+"""
+
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+
+# How long (in seconds) a lock is held before it's considered abandoned --
+# this keeps a crashed worker from wedging an object forever.
+LOCK_TIMEOUT = getattr(settings, 'STORYMARKET_SYNC_LOCK_TIMEOUT', 300)
+
+# How long (in seconds) a contended caller waits for the lock.
+LOCK_WAIT = getattr(settings, 'STORYMARKET_SYNC_LOCK_WAIT', 60)
+
+# How often (in seconds) a waiting caller polls for the lock.
+LOCK_POLL_INTERVAL = 0.25
+
+class SyncLockTimeout(Exception):
+    pass
+
+def lock_key(obj):
+    """
+    The cache key used to lock syncing of ``obj``.
+    """
+    return 'storymarket_sync_lock:%s:%s' % (obj._meta, obj.pk)
+
+class SyncLock(object):
+    """
+    A lock on syncing a single Django object.
+
+    Use it like so::
+
+        lock = SyncLock(obj)
+        if lock.acquire():
+            try:
+                ...
+            finally:
+                lock.release()
+
+    ``acquire()`` returns ``True`` if the lock was taken right away and
+    ``False`` if another sync had to be waited on first; callers can use
+    this to decide whether the other sync already did their work for them.
+    """
+    def __init__(self, obj, timeout=None, wait=None):
+        self.key = lock_key(obj)
+        self.timeout = LOCK_TIMEOUT if timeout is None else timeout
+        self.wait = LOCK_WAIT if wait is None else wait
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        """
+        Take the lock, waiting for up to ``self.wait`` seconds if somebody
+        else holds it.
+
+        Raises :exc:`SyncLockTimeout` if the lock can't be taken in time.
+        """
+        if cache.add(self.key, self.token, self.timeout):
+            return True
+
+        deadline = time.time() + self.wait
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            if cache.add(self.key, self.token, self.timeout):
+                return False
+        raise SyncLockTimeout("Timed out waiting for %s." % self.key)
+
+    def release(self):
+        """
+        Release the lock, but only if it's still ours -- if it expired and
+        somebody else took it we mustn't yank it out from under them.
+        """
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
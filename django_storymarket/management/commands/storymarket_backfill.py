@@ -0,0 +1,80 @@
+import multiprocessing
+from optparse import make_option
+from django.db import connection, models
+from django.core.management.base import NoArgsCommand, CommandError
+from django_storymarket import backfill, converters
+from django_storymarket.planning import SyncPlan
+
+class Command(NoArgsCommand):
+    help = ("Upload all existing objects of registered models to Storymarket, "
+            "sharded by primary key across a pool of processes. Progress is "
+            "checkpointed, so re-running a killed backfill resumes it.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--run', dest='run', default='backfill',
+                    help='Name of this backfill; reuse it to resume (default: "backfill").'),
+        make_option('--model', dest='models', action='append', default=[],
+                    help='Only backfill this model (app_label.modelname); repeatable.'),
+        make_option('--processes', dest='processes', type='int',
+                    default=multiprocessing.cpu_count(),
+                    help='Number of worker processes (default: one per CPU).'),
+        make_option('--shard-size', dest='shard_size', type='int', default=1000,
+                    help='Objects per shard (default: 1000).'),
+        make_option('--resync', dest='resync', action='store_true', default=False,
+                    help='Upload objects even if they have already been synced.'),
+        make_option('--autosync', dest='autosync', action='store_true', default=False,
+                    help="Only upload objects matching their model's autosync rules."),
+        make_option('--plan', dest='plan', action='store_true', default=False,
+                    help="Don't upload anything; report what the backfill would do."),
+    )
+
+    def handle_noargs(self, **options):
+        if options['models']:
+            targets = []
+            for label in options['models']:
+                model = models.get_model(*label.split('.'))
+                if model is None:
+                    raise CommandError("Unknown model: %s" % label)
+                targets.append(model)
+        else:
+            targets = converters.registered_models()
+
+        for model in targets:
+            if not isinstance(model._meta.pk, (models.AutoField, models.IntegerField)):
+                raise CommandError("Can't shard %s: its primary key isn't an integer." % model._meta)
+
+        if options['plan']:
+            plan = SyncPlan()
+            for model in targets:
+                backfill.plan_backfill(model, options['shard_size'], options['resync'],
+                                       options['autosync'], plan)
+            print plan.summary()
+            return
+
+        shards = []
+        for model in targets:
+            shards.extend(backfill.plan_shards(options['run'], model, options['shard_size']))
+
+        if not shards:
+            print "Nothing left to backfill for run %r." % options['run']
+            return
+        print "Backfilling %d shards with %d processes." % (len(shards), options['processes'])
+
+        # Close our connection so the forked workers don't share it.
+        connection.close()
+        pool = multiprocessing.Pool(options['processes'], backfill._pool_initializer)
+        try:
+            jobs = [(shard.pk, options['resync'], options['autosync']) for shard in shards]
+            total_synced = total_failed = 0
+            for i, (shard_id, synced, failed) in enumerate(pool.imap_unordered(backfill._pool_process_shard, jobs)):
+                total_synced += synced
+                total_failed += failed
+                print "[%d/%d] shard %s: %d synced, %d failed" % (i + 1, len(jobs), shard_id, synced, failed)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        print "Done: %d synced, %d failed." % (total_synced, total_failed)
@@ -0,0 +1,29 @@
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django_storymarket.models import ConverterProfile
+
+class Command(NoArgsCommand):
+    help = ("Print converters ranked by mean time per call, as recorded "
+            "with STORYMARKET_PROFILE_CONVERTERS turned on.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--reset', action='store_true', dest='reset', default=False,
+                    help='Delete the recorded profiles after printing them.'),
+    )
+
+    def handle_noargs(self, **options):
+        profiles = sorted(ConverterProfile.objects.all(),
+                          key=lambda p: p.mean_time, reverse=True)
+        if not profiles:
+            print "No converter profiles recorded. Is STORYMARKET_PROFILE_CONVERTERS on?"
+            return
+
+        row = "%-40s %8s %10s %10s %9s %9s %10s %6s"
+        print row % ('model', 'calls', 'mean ms', 'max ms', 'mean q', 'max q', 'max mem KB', 'slow')
+        for p in profiles:
+            print row % (p.model, p.calls,
+                         '%.1f' % (p.mean_time * 1000), '%.1f' % (p.max_time * 1000),
+                         '%.1f' % p.mean_queries, p.max_queries, p.max_memory, p.slow_calls)
+
+        if options['reset']:
+            ConverterProfile.objects.all().delete()
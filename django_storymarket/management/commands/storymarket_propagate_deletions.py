@@ -0,0 +1,15 @@
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django_storymarket.deletions import propagate_deletions
+
+class Command(NoArgsCommand):
+    help = "Delete the Storymarket items of synced objects that have been deleted locally."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='Number of deletions to handle at a time (default: 500).'),
+    )
+
+    def handle_noargs(self, **options):
+        deleted, failed = propagate_deletions(options['batch_size'])
+        print "Deleted %d items from Storymarket; %d failed and will be retried." % (deleted, failed)
@@ -0,0 +1,28 @@
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django_storymarket.reconcile import reconcile
+
+class Command(NoArgsCommand):
+    help = ("Compare local sync records against the items on Storymarket and "
+            "report (or, with --fix, repair) any drift.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--fix', dest='fix', action='store_true', default=False,
+                    help='Update drifted records and delete missing and orphaned ones.'),
+        make_option('--page-size', dest='page_size', type='int', default=100,
+                    help='Number of Storymarket items to fetch per request (default: 100).'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        def report(kind, message):
+            if verbosity > 1:
+                print "%s: %s" % (kind, message)
+
+        counts = reconcile(fix=options['fix'], page_size=options['page_size'], report=report)
+        for kind in ('drifted', 'missing', 'orphaned', 'untracked', 'incomplete'):
+            print "%-10s %d" % (kind, counts[kind])
+        if options['fix']:
+            print "Drifted, missing and orphaned records have been fixed."
+            if counts['incomplete']:
+                print "Types that couldn't be listed were skipped; run again to check them."
@@ -0,0 +1,34 @@
+import datetime
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django_storymarket import history
+
+class Command(NoArgsCommand):
+    help = "Print per-model sync throughput and error rates, optionally pruning old sync history first."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=7,
+                    help='Report on the last DAYS days (default: 7).'),
+        make_option('--prune', action='store_true', dest='prune', default=False,
+                    help='Roll up complete days and delete attempts older than STORYMARKET_HISTORY_DAYS.'),
+        make_option('--keep', dest='keep', type='int', default=None,
+                    help='With --prune, keep this many days of attempts instead.'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['prune']:
+            rolled_up, deleted = history.prune(options['keep'])
+            print "Rolled up %d days; deleted %d old sync attempts." % (rolled_up, deleted)
+
+        since = datetime.date.today() - datetime.timedelta(days=options['days'] - 1)
+        stats = history.model_stats(since)
+        if not stats:
+            print "No syncs since %s." % since
+            return
+
+        row = "%-40s %9s %9s %8s %9s %10s %10s"
+        print row % ('model', 'attempts', 'per day', 'errors', 'error %', 'mean ms', 'MB')
+        for s in stats:
+            print row % (s['model'], s['attempts'], '%.1f' % s['per_day'], s['failures'],
+                         '%.1f' % (s['error_rate'] * 100), '%.1f' % (s['mean_duration'] * 1000),
+                         '%.1f' % (s['bytes'] / (1024.0 * 1024)))
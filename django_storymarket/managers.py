@@ -1,6 +1,23 @@
 import datetime
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
+from . import clients
+
+def synced_fields(storymarket_obj):
+    """
+    The fields of a ``SyncedObject`` that mirror a Storymarket content object.
+    """
+    # Imported here; retries needs the models, which need this module.
+    from .retries import strip_sync_tags
+    return dict(
+        storymarket_type = storymarket_obj.__class__.__name__.lower(),
+        storymarket_id   = storymarket_obj.id,
+        tags             = strip_sync_tags(storymarket_obj.tags),
+        org              = storymarket_obj.org.id,
+        category         = storymarket_obj.category.id,
+        pricing          = (storymarket_obj.pricing_scheme.id if storymarket_obj.pricing_scheme else None),
+        rights           = (storymarket_obj.rights_scheme.id if storymarket_obj.rights_scheme else None),
+    )
 
 class SyncedObjectManager(models.Manager):
     def for_model(self, obj):
@@ -25,22 +42,18 @@ class SyncedObjectManager(models.Manager):
             object_pk = obj.pk,
         )
         
-    def mark_synced(self, django_obj, storymarket_obj):
+    def mark_synced(self, django_obj, storymarket_obj, account=clients.DEFAULT_ACCOUNT):
         """
-        Mark ``django_obj`` as having been synced to ``storymarket_obj``.
+        Mark ``django_obj`` as having been synced to ``storymarket_obj``
+        on the Storymarket ``account``.
         
         Returns ``(SyncedObject, created)``, just like ``get_or_create()``.
         """
-        defaults = dict(
-            storymarket_type = storymarket_obj.__class__.__name__.lower(),
-            storymarket_id   = storymarket_obj.id,
-            tags             = storymarket_obj.tags,
-            org              = storymarket_obj.org.id,
-            category         = storymarket_obj.category.id,
-            pricing          = (storymarket_obj.pricing_scheme.id if storymarket_obj.pricing_scheme else None),
-            rights           = (storymarket_obj.rights_scheme.id if storymarket_obj.rights_scheme else None),
-            last_updated     = datetime.datetime.now(),
-        )
+        defaults = synced_fields(storymarket_obj)
+        defaults['last_updated'] = datetime.datetime.now()
+        defaults['account'] = account
+        defaults['state'] = self.model.SYNCED
+        defaults['idempotency_key'] = ''
         so, created = self.get_or_create(
             content_type = ContentType.objects.get_for_model(django_obj),
             object_pk = django_obj.pk,
@@ -50,4 +63,24 @@ class SyncedObjectManager(models.Manager):
             so.__dict__.update(defaults)
             so.save()
         
-        return so, created
\ No newline at end of file
+        return so, created
+        
+    def mark_pending(self, django_obj, storymarket_type, idempotency_key):
+        """
+        Record that ``django_obj`` is about to be created on Storymarket
+        by the attempt ``idempotency_key``.
+        
+        If it's been synced before, the record keeps pointing at the old
+        item until :meth:`mark_synced` is called.
+        """
+        so, created = self.get_or_create(
+            content_type = ContentType.objects.get_for_model(django_obj),
+            object_pk = django_obj.pk,
+            defaults = dict(storymarket_type=storymarket_type, state=self.model.PENDING,
+                            idempotency_key=idempotency_key),
+        )
+        if not created:
+            so.state = self.model.PENDING
+            so.idempotency_key = idempotency_key
+            so.save()
+        return so
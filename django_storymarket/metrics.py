@@ -0,0 +1,126 @@
+"""
+Timing and counting of each stage of a sync.
+
+Every instrumented stage sends :data:`~django_storymarket.signals.sync_stage_finished`
+and reports to a pluggable metrics backend. The backend is chosen with the
+``STORYMARKET_METRICS_BACKEND`` setting, a dotted path to a class; the
+default discards everything. For example, to send to StatsD::
+
+    STORYMARKET_METRICS_BACKEND = 'django_storymarket.metrics.StatsdBackend'
+
+Backends get metric names like ``storymarket.create`` along with a dict of
+tags (``model``, ``storymarket_type``, ...) which backends that support
+tagging can use and others can ignore.
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils.importlib import import_module
+from .signals import sync_stage_finished
+
+log = logging.getLogger('django_storymarket')
+
+class BaseBackend(object):
+    """
+    A metrics backend. Subclasses need to implement ``incr`` and ``timing``.
+    """
+    def incr(self, name, value=1, tags=None):
+        """
+        Increment the counter ``name`` by ``value``.
+        """
+        raise NotImplementedError
+
+    def timing(self, name, seconds, tags=None):
+        """
+        Record a sample of ``seconds`` in the histogram ``name``.
+        """
+        raise NotImplementedError
+
+class NullBackend(BaseBackend):
+    """
+    Throws metrics away.
+    """
+    def incr(self, name, value=1, tags=None):
+        pass
+
+    def timing(self, name, seconds, tags=None):
+        pass
+
+class LoggingBackend(BaseBackend):
+    """
+    Writes metrics to the ``django_storymarket`` logger at DEBUG level.
+    """
+    def incr(self, name, value=1, tags=None):
+        log.debug('%s +%s %r', name, value, tags or {})
+
+    def timing(self, name, seconds, tags=None):
+        log.debug('%s %.1fms %r', name, seconds * 1000, tags or {})
+
+class StatsdBackend(BaseBackend):
+    """
+    Sends metrics to StatsD. Requires the ``statsd`` package; configure
+    it with ``STATSD_HOST`` and ``STATSD_PORT``.
+
+    StatsD doesn't do tags, so the model is folded into the metric name
+    (``storymarket.create.myapp.story``).
+    """
+    def __init__(self):
+        import statsd
+        self.client = statsd.StatsClient(getattr(settings, 'STATSD_HOST', 'localhost'),
+                                         getattr(settings, 'STATSD_PORT', 8125))
+
+    def _name(self, name, tags):
+        if tags and tags.get('model'):
+            return '%s.%s' % (name, tags['model'])
+        return name
+
+    def incr(self, name, value=1, tags=None):
+        self.client.incr(self._name(name, tags), value)
+
+    def timing(self, name, seconds, tags=None):
+        self.client.timing(self._name(name, tags), seconds * 1000)
+
+_backend = None
+def get_backend():
+    """
+    Return the configured metrics backend instance.
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'STORYMARKET_METRICS_BACKEND',
+                       'django_storymarket.metrics.NullBackend')
+        module_name, class_name = path.rsplit('.', 1)
+        _backend = getattr(import_module(module_name), class_name)()
+    return _backend
+
+@contextmanager
+def timer(stage, **tags):
+    """
+    Time the enclosed block as the sync stage ``stage``. Yields the tags
+    dict so the block can add to it (bytes uploaded, for example)::
+
+        with metrics.timer('upload_blob', model='myapp.story') as tags:
+            tags['bytes'] = len(blob)
+            ...
+
+    Exceptions are counted as ``storymarket.<stage>.errors`` and re-raised.
+    """
+    backend = get_backend()
+    start = time.time()
+    try:
+        yield tags
+    except:
+        tags['failed'] = True
+        backend.incr('storymarket.%s.errors' % stage, tags=tags)
+        raise
+    finally:
+        duration = time.time() - start
+        backend.timing('storymarket.%s' % stage, duration, tags=tags)
+        backend.incr('storymarket.%s.count' % stage, tags=tags)
+        if tags.get('bytes'):
+            backend.incr('storymarket.%s.bytes' % stage, tags['bytes'], tags=tags)
+        if tags.get('retries'):
+            backend.incr('storymarket.%s.retries' % stage, tags['retries'], tags=tags)
+        sync_stage_finished.send(sender=stage, stage=stage, duration=duration, tags=tags)
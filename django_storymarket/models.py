@@ -1,12 +1,13 @@
 import datetime
 import operator
-import storymarket
 from django.db import models
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
+from . import clients
 from . import converters 
 from . import managers
+from . import syncstatus
 
 STORYMARKET_TYPES = ("audio", "data", "photo", "text", "video")
 STORYMARKET_TYPE_CHOICES = [(t, t) for t in STORYMARKET_TYPES]
@@ -24,25 +25,104 @@ class SyncedObject(models.Model):
     object_pk    = models.TextField()
     object       = GenericForeignKey('content_type', 'object_pk')
     
-    # The Storymarket content object that's been synced to.
+    # The Storymarket content object that's been synced to. Blank if the
+    # object's first sync is still pending.
     storymarket_type = models.CharField(max_length=50, choices=STORYMARKET_TYPE_CHOICES)
-    storymarket_id   = models.PositiveIntegerField()
+    storymarket_id   = models.PositiveIntegerField(blank=True, null=True)
     
     # For ease of local reference, the related org/category/etc.
     tags     = models.CharField(max_length=500)
-    org      = models.PositiveIntegerField()
-    category = models.PositiveIntegerField()
+    org      = models.PositiveIntegerField(blank=True, null=True)
+    category = models.PositiveIntegerField(blank=True, null=True)
     pricing  = models.PositiveIntegerField(blank=True, null=True)
     rights   = models.PositiveIntegerField(blank=True, null=True)
     
     # When we last did a sync.
     last_updated = models.DateTimeField(default=datetime.datetime.now)
     
+    # The Storymarket account the object was synced with. See
+    # :mod:`django_storymarket.clients`.
+    account = models.CharField(max_length=100, default=clients.DEFAULT_ACCOUNT, db_index=True)
+    
+    # A sync creating a new Storymarket item marks the record pending, under
+    # a key identifying the attempt, until it knows the item's been created.
+    # See :mod:`django_storymarket.retries`.
+    SYNCED, PENDING = 'synced', 'pending'
+    state           = models.CharField(max_length=10, default=SYNCED,
+                                       choices=[(SYNCED, 'Synced'), (PENDING, 'Pending')])
+    idempotency_key = models.CharField(max_length=32, blank=True)
+    
     objects = managers.SyncedObjectManager()
     
     def __unicode__(self):
         return "%s synced as %s ID=%s" % (self.object, self.storymarket_type, self.storymarket_id)
     
+class SyncedBlob(models.Model):
+    """
+    A blob that's been uploaded to Storymarket, by content hash, so that
+    identical media can be linked to the existing item instead of being
+    uploaded again. See :mod:`django_storymarket.blobs`.
+    """
+    content_hash     = models.CharField(max_length=40, db_index=True)
+    storymarket_type = models.CharField(max_length=50, choices=STORYMARKET_TYPE_CHOICES)
+    storymarket_id   = models.PositiveIntegerField()
+    size             = models.BigIntegerField(blank=True, null=True)
+    uploaded         = models.DateTimeField(default=datetime.datetime.now)
+    
+    class Meta:
+        unique_together = [('content_hash', 'storymarket_type')]
+    
+    def __unicode__(self):
+        return "%s blob %s (ID=%s)" % (self.storymarket_type, self.content_hash, self.storymarket_id)
+    
+class SyncTombstone(models.Model):
+    """
+    Records the deletion of a Django object that may have been synced to
+    Storymarket, so that the deletion can be propagated in the background
+    by :func:`django_storymarket.deletions.propagate_deletions`.
+    """
+    content_type = models.ForeignKey(ContentType, related_name='storymarket_tombstones')
+    object_pk    = models.TextField()
+    deleted      = models.DateTimeField(default=datetime.datetime.now)
+    
+    def __unicode__(self):
+        return "Deleted %s %s" % (self.content_type, self.object_pk)
+    
+def record_deletion(sender, instance, **kwargs):
+    """
+    ``post_delete`` handler recording a :class:`SyncTombstone` for deleted
+    objects of convertible models. This is just a single insert; the
+    Storymarket side of things is left for later.
+    
+    A fallback converter can convert any model, so objects that only have
+    that are checked for a sync record first.
+    """
+    if sender._meta.app_label == 'django_storymarket':
+        return
+    if converters.get_converter(sender) is None:
+        return
+    if not converters.has_registered_converter(sender) and \
+            not SyncedObject.objects.for_model(instance).exists():
+        return
+    SyncTombstone.objects.create(content_type=_ct(sender), object_pk=instance.pk)
+    
+models.signals.post_delete.connect(record_deletion, dispatch_uid='storymarket_record_deletion')
+
+def update_sync_status(sender, instance, **kwargs):
+    """
+    Keep the cached sync status (see :mod:`django_storymarket.syncstatus`)
+    current as ``SyncedObject`` records are saved and deleted.
+    """
+    syncstatus.remember(instance)
+    
+def clear_sync_status(sender, instance, **kwargs):
+    syncstatus.forget(instance)
+    
+models.signals.post_save.connect(update_sync_status, sender=SyncedObject,
+                                 dispatch_uid='storymarket_update_sync_status')
+models.signals.post_delete.connect(clear_sync_status, sender=SyncedObject,
+                                   dispatch_uid='storymarket_clear_sync_status')
+
 class AutoSyncedModel(models.Model):
     """
     A model that should be auto-synced to Storymarket, perhaps upon
@@ -51,7 +131,7 @@ class AutoSyncedModel(models.Model):
     content_type = models.ForeignKey(ContentType, 
                                      related_name='storymarket_autosynced_models',
                                      limit_choices_to=models.Q(
-                                        id__in=lambda: [_ct(m).id for m in converters.registered_models()]
+                                        id__in=converters.registered_content_type_ids
                                      ))
     enabled = models.BooleanField(default=False)
     
@@ -71,6 +151,64 @@ class AutoSyncedModel(models.Model):
                 return False
             
         return True
+        
+    def sync_pks(self, queryset=None, batch_size=1000):
+        """
+        Yield the primary keys of all objects that should be synced.
+        
+        Equivalent to calling :meth:`should_sync` on every object in
+        ``queryset`` (default: all objects of the model), but when the
+        rules only refer to plain fields, they're checked against
+        ``values_list()`` rows of just those fields, ``batch_size`` rows at a
+        time, without building any model instances.
+        """
+        if not self.enabled:
+            return
+        model = self.content_type.model_class()
+        if queryset is None:
+            queryset = model._default_manager.all()
+        rules = list(self.rules.all())
+        
+        columns = _value_columns(model, [rule.field for rule in rules])
+        if columns is None:
+            # Some rule needs a real instance (a property, a related
+            # object, ...); fall back to checking instances one by one.
+            for obj in queryset.iterator():
+                if all(rule.should_sync(obj) is not False for rule in rules):
+                    yield obj.pk
+            return
+        
+        queryset = queryset.order_by('pk')
+        last_pk = None
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(batch.values_list('pk', *[columns[r.field] for r in rules])[:batch_size])
+            if not rows:
+                return
+            for row in rows:
+                if all(rule.check_value(value) is not False for (rule, value) in zip(rules, row[1:])):
+                    yield row[0]
+            last_pk = rows[-1][0]
+
+def _value_columns(model, field_names):
+    """
+    Map each attribute name in ``field_names`` to the ``values_list()``
+    column giving the same value as ``getattr()`` on an instance, or return
+    ``None`` if any of them has no such column.
+    """
+    columns = {}
+    for name in field_names:
+        for f in model._meta.fields:
+            if name == f.attname:
+                # For foreign keys, the attname ("author_id") is the one
+                # getattr() and values_list() (as "author") agree on.
+                columns[name] = f.name
+                break
+        else:
+            if name != 'pk':
+                return None
+            columns[name] = 'pk'
+    return columns
 
 AUTO_SYNC_INCLUDE_CHOICES = (
     (True,  'include'),
@@ -145,29 +283,149 @@ class AutoSyncRule(models.Model):
             field_val = getattr(instance, self.field)
         except AttributeError:
             return None
+        return self.check_value(field_val)
         
-        # Try to look up the operator function, first as a member
-        # of the operator library, and then as a str method
-        op_func_name = self.op.lstrip('!')
-        try:
-            op_func = getattr(operator, op_func_name)
-        except AttributeError:
-            try:
-                op_func = getattr(str, op_func_name)
-            except AttributeError:
-                return None 
-        
-        # If the op was a negative one, negate the op.
-        if self.op.startswith('!'):
-            op_func = lambda lhs, rhs: not op_func(lhs, rhs)
+    def check_value(self, field_val):
+        """
+        Like :meth:`should_sync`, but given the value of the rule's field
+        instead of a whole instance.
+        """
+        op_func = self._op_func()
+        if op_func is None:
+            return None
         
         # Try to check for a match.
         try:
             match = op_func(field_val, self.value)
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, AttributeError):
             return None
         
         # Negate the match if self.include is False (and thus this is an
         # exclude rule).
         return match if self.include else not match
         
+    def _op_func(self):
+        """
+        The function implementing self.op, or None if there isn't one.
+        Looked up once and cached on the rule.
+        """
+        if getattr(self, '_op_func_cache', (None, None))[0] == self.op:
+            return self._op_func_cache[1]
+        
+        # Try to look up the operator function, first as a member
+        # of the operator library, and then as a string method. String
+        # methods are called on the value itself so they work for both
+        # str and unicode.
+        op_func_name = self.op.lstrip('!')
+        try:
+            op_func = getattr(operator, op_func_name)
+        except AttributeError:
+            if hasattr(str, op_func_name):
+                op_func = lambda lhs, rhs: getattr(lhs, op_func_name)(rhs)
+            else:
+                op_func = None
+        
+        # If the op was a negative one, negate the op.
+        if op_func is not None and self.op.startswith('!'):
+            positive_func = op_func
+            op_func = lambda lhs, rhs: not positive_func(lhs, rhs)
+        
+        self._op_func_cache = (self.op, op_func)
+        return op_func
+
+class ConverterProfile(models.Model):
+    """
+    Aggregate timings for a single converter, collected when
+    ``STORYMARKET_PROFILE_CONVERTERS`` is on. See
+    :mod:`django_storymarket.profiling`.
+    """
+    # The registry key of the converter ("app_label.modelname" or "*").
+    model = models.CharField(max_length=200, unique=True)
+    
+    calls         = models.PositiveIntegerField(default=0)
+    slow_calls    = models.PositiveIntegerField(default=0)
+    total_time    = models.FloatField(default=0)
+    max_time      = models.FloatField(default=0)
+    total_queries = models.PositiveIntegerField(default=0)
+    max_queries   = models.PositiveIntegerField(default=0)
+    
+    # Largest growth in peak memory seen during a single call, in KB.
+    max_memory = models.PositiveIntegerField(default=0)
+    
+    def __unicode__(self):
+        return "Converter profile for %s" % self.model
+        
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0
+        
+    @property
+    def mean_queries(self):
+        return float(self.total_queries) / self.calls if self.calls else 0
+
+class BackfillShard(models.Model):
+    """
+    A primary key range of a model being backfilled to Storymarket by the
+    ``storymarket_backfill`` command, and how far along it is. Kept around
+    so that a killed backfill can pick up where it left off.
+    """
+    run          = models.CharField(max_length=100)
+    content_type = models.ForeignKey(ContentType, related_name='storymarket_backfill_shards')
+    
+    # The range of primary keys in this shard, [start_pk, end_pk).
+    start_pk = models.BigIntegerField()
+    end_pk   = models.BigIntegerField()
+    
+    # The last primary key handled; the shard resumes after it.
+    last_pk  = models.BigIntegerField(blank=True, null=True)
+    
+    synced  = models.PositiveIntegerField(default=0)
+    failed  = models.PositiveIntegerField(default=0)
+    done    = models.BooleanField(default=False)
+    last_updated = models.DateTimeField(default=datetime.datetime.now)
+    
+    class Meta:
+        unique_together = [('run', 'content_type', 'start_pk')]
+        ordering = ['run', 'content_type', 'start_pk']
+    
+    def __unicode__(self):
+        return "%s: %s pks %s-%s" % (self.run, self.content_type, self.start_pk, self.end_pk)
+
+
+class SyncAttempt(models.Model):
+    """
+    A single attempt to sync an object, successful or not. Append-only,
+    written in batches and pruned after ``STORYMARKET_HISTORY_DAYS``; see
+    :mod:`django_storymarket.history`.
+    """
+    content_type     = models.ForeignKey(ContentType, related_name='storymarket_sync_attempts')
+    object_pk        = models.TextField()
+    storymarket_type = models.CharField(max_length=50)
+    started          = models.DateTimeField(db_index=True)
+    duration         = models.FloatField()
+    bytes            = models.BigIntegerField(blank=True, null=True)
+    succeeded        = models.BooleanField(default=True)
+    error            = models.CharField(max_length=200, blank=True)
+    
+    def __unicode__(self):
+        return "%s sync of %s %s at %s" % ("Successful" if self.succeeded else "Failed",
+                                           self.content_type, self.object_pk, self.started)
+    
+class SyncRollup(models.Model):
+    """
+    Daily totals of :class:`SyncAttempt`\s for a model, kept after the
+    attempts themselves are pruned.
+    """
+    day            = models.DateField()
+    content_type   = models.ForeignKey(ContentType, related_name='storymarket_sync_rollups')
+    attempts       = models.PositiveIntegerField(default=0)
+    failures       = models.PositiveIntegerField(default=0)
+    total_duration = models.FloatField(default=0)
+    bytes          = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = [('day', 'content_type')]
+        ordering = ['day', 'content_type']
+    
+    def __unicode__(self):
+        return "%s syncs of %s on %s" % (self.attempts, self.content_type, self.day)
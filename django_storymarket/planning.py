@@ -0,0 +1,122 @@
+"""
+Dry-run planning of syncs.
+
+A :class:`SyncPlan` goes through the same conversion and rule checks a real
+sync would, but makes no API writes; instead it tallies what *would*
+happen -- creates, updates, skips, blobs and bytes -- and estimates the API
+calls and time needed. Useful for fitting big syncs into API quotas and
+maintenance windows.
+"""
+
+from django.conf import settings
+from . import blobs, budgets, converters
+from .models import SyncedObject
+
+# Assumed upload throughput, for estimating blob upload time.
+UPLOAD_BYTES_PER_SECOND = getattr(settings, 'STORYMARKET_UPLOAD_BYTES_PER_SECOND', 1024 * 1024)
+
+class SyncPlan(object):
+    """
+    A tally of the work a sync would do. Feed it objects with :meth:`add`
+    (or :meth:`add_converted` for already-converted data) and read off
+    the counts, :attr:`api_calls` and :attr:`estimated_duration`.
+    """
+    def __init__(self):
+        self.creates = 0
+        self.updates = 0
+        self.skips = 0
+        self.linked = 0
+        self.blobs = 0
+        self.bytes = 0
+        self.unknown_sizes = 0
+        self.create_calls = 0
+        self.upload_calls = 0
+
+    def add(self, obj, autosync=None):
+        """
+        Plan syncing ``obj``: convert it and, if ``autosync`` (an
+        :class:`~django_storymarket.models.AutoSyncedModel`) is given,
+        check its rules first.
+        """
+        if autosync is not None and not autosync.should_sync(obj):
+            self.skip(obj)
+            return
+        try:
+            data = converters.convert(obj)
+        except converters.CannotConvert:
+            self.skip(obj)
+            return
+        self.add_converted(obj, data.pop('type'), data)
+
+    def add_converted(self, obj, storymarket_type, data):
+        """
+        Plan ``save_to_storymarket(obj, storymarket_type, data)``. ``data``
+        isn't modified.
+        """
+        if storymarket_type == 'package':
+            for subitem in data.get('items', []):
+                subitem = subitem.copy()
+                subobj = subitem.pop('object')
+                self.add_converted(subobj, subitem.pop('type').rstrip('s'), subitem)
+
+        blob = data.get('blob')
+        if blob and blobs.DEDUPLICATE_BLOBS:
+            content_hash, blob = blobs.hash_blob(blob)
+            if blobs.find_uploaded(content_hash, storymarket_type):
+                self.linked += 1
+                self._count_sync(obj)
+                return
+
+        self._count_sync(obj)
+        self.create_calls += 1
+        if blob:
+            self.blobs += 1
+            self.upload_calls += 1
+            size = blobs.blob_size(blob)
+            if size is None:
+                self.unknown_sizes += 1
+            else:
+                self.bytes += size
+
+    def skip(self, obj):
+        self.skips += 1
+
+    def _count_sync(self, obj):
+        if SyncedObject.objects.for_model(obj).filter(storymarket_id__isnull=False).exists():
+            self.updates += 1
+        else:
+            self.creates += 1
+
+    @property
+    def api_calls(self):
+        return self.create_calls + self.upload_calls
+
+    @property
+    def estimated_duration(self):
+        """
+        Estimated time (in seconds) the sync would take done serially.
+        """
+        return (self.create_calls * budgets.api_latency() +
+                float(self.bytes) / UPLOAD_BYTES_PER_SECOND)
+
+    def summary(self):
+        """
+        A one-paragraph, human-readable summary of the plan.
+        """
+        lines = [
+            "%d creates, %d updates, %d skipped, %d linked to existing items." % (
+                self.creates, self.updates, self.skips, self.linked),
+            "%d blobs totalling %.1f MB%s." % (
+                self.blobs, self.bytes / (1024.0 * 1024),
+                " (plus %d of unknown size)" % self.unknown_sizes if self.unknown_sizes else ""),
+            "About %d API calls, taking roughly %s." % (
+                self.api_calls, _format_duration(self.estimated_duration)),
+        ]
+        return " ".join(lines)
+
+def _format_duration(seconds):
+    if seconds < 60:
+        return "%d seconds" % seconds
+    if seconds < 3600:
+        return "%.1f minutes" % (seconds / 60)
+    return "%.1f hours" % (seconds / 3600)
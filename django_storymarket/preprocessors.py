@@ -0,0 +1,115 @@
+"""
+Optional preprocessing of blobs before they're uploaded.
+
+Storymarket doesn't need full-resolution masters, and upload time scales
+with the bytes sent, so blobs can be run through a preprocessor -- chosen
+per Storymarket type -- right before upload::
+
+    STORYMARKET_BLOB_PREPROCESSORS = {
+        'photo': 'django_storymarket.preprocessors.downsize_photo',
+    }
+
+A preprocessor is a function taking the blob (a string or file-like object)
+and returning the processed data as a string. Preprocessing runs wherever
+the upload does -- in the Celery worker if ``STORYMARKET_QUEUE_UPLOADS`` is
+on -- and results are saved to the default file storage under
+``STORYMARKET_PREPROCESSED_DIR``, named by the hash of the original, so
+syncing the same media again doesn't redo the work.
+"""
+
+import StringIO
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils.importlib import import_module
+
+
+PREPROCESSORS = getattr(settings, 'STORYMARKET_BLOB_PREPROCESSORS', {})
+PREPROCESSED_DIR = getattr(settings, 'STORYMARKET_PREPROCESSED_DIR', 'storymarket/preprocessed')
+
+# Settings for downsize_photo.
+PHOTO_MAX_DIMENSION = getattr(settings, 'STORYMARKET_PHOTO_MAX_DIMENSION', 2048)
+PHOTO_QUALITY = getattr(settings, 'STORYMARKET_PHOTO_QUALITY', 85)
+PHOTO_MIN_QUALITY = getattr(settings, 'STORYMARKET_PHOTO_MIN_QUALITY', 55)
+PHOTO_TARGET_BYTES = getattr(settings, 'STORYMARKET_PHOTO_TARGET_BYTES', 1024 * 1024)
+
+_preprocessors = {}
+def get_preprocessor(storymarket_type):
+    """
+    Return the preprocessor function for a Storymarket type, or ``None``.
+    """
+    storymarket_type = storymarket_type.rstrip('s')
+    if storymarket_type not in _preprocessors:
+        path = PREPROCESSORS.get(storymarket_type)
+        if path:
+            module_name, func_name = path.rsplit('.', 1)
+            _preprocessors[storymarket_type] = getattr(import_module(module_name), func_name)
+        else:
+            _preprocessors[storymarket_type] = None
+    return _preprocessors[storymarket_type]
+
+def preprocess(storymarket_type, blob, content_hash=None):
+    """
+    Run ``blob`` through the preprocessor for ``storymarket_type``, if
+    there is one, and return the result. Otherwise returns ``blob``
+    untouched.
+
+    ``content_hash`` is the hash of the original blob, if it's already
+    known; it's computed if not.
+    """
+    preprocessor = get_preprocessor(storymarket_type)
+    if preprocessor is None:
+        return blob
+
+    from .blobs import hash_blob
+    if content_hash is None:
+        content_hash, blob = hash_blob(blob)
+
+    name = '%s/%s-%s' % (PREPROCESSED_DIR, storymarket_type.rstrip('s'), content_hash)
+    if default_storage.exists(name):
+        f = default_storage.open(name, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    processed = preprocessor(blob)
+    default_storage.save(name, ContentFile(processed))
+    return processed
+
+def downsize_photo(blob):
+    """
+    Shrink a photo to fit within ``STORYMARKET_PHOTO_MAX_DIMENSION`` pixels
+    and re-encode it as a JPEG, lowering quality step by step (down to
+    ``STORYMARKET_PHOTO_MIN_QUALITY``) until it's under
+    ``STORYMARKET_PHOTO_TARGET_BYTES``.
+
+    If that doesn't make the photo any smaller the original is returned.
+    Requires PIL.
+    """
+    # PIL's slow to import, so that's left until it's needed.
+    try:
+        from PIL import Image
+    except ImportError:
+        try:
+            import Image
+        except ImportError:
+            raise ImproperlyConfigured("downsize_photo requires PIL.")
+
+    original = blob if isinstance(blob, basestring) else blob.read()
+    image = Image.open(StringIO.StringIO(original))
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.thumbnail((PHOTO_MAX_DIMENSION, PHOTO_MAX_DIMENSION), Image.ANTIALIAS)
+
+    quality = PHOTO_QUALITY
+    while True:
+        out = StringIO.StringIO()
+        image.save(out, 'JPEG', quality=quality, optimize=True)
+        if out.tell() <= PHOTO_TARGET_BYTES or quality <= PHOTO_MIN_QUALITY:
+            break
+        quality = max(quality - 10, PHOTO_MIN_QUALITY)
+
+    processed = out.getvalue()
+    return processed if len(processed) < len(original) else original
@@ -0,0 +1,124 @@
+"""
+Opt-in profiling of converters.
+
+Converters are arbitrary user code, and a slow one drags down every bulk
+sync. Set ``STORYMARKET_PROFILE_CONVERTERS = True`` and each call to
+:func:`~django_storymarket.converters.convert` will record the wall time,
+number of queries, and peak memory growth of the converter into
+:class:`~django_storymarket.models.ConverterProfile`. Calls slower than
+``STORYMARKET_SLOW_CONVERTER_SECONDS`` or issuing more than
+``STORYMARKET_SLOW_CONVERTER_QUERIES`` queries are logged as warnings.
+
+Run ``manage.py storymarket_converter_report`` to see the results.
+"""
+
+import time
+import logging
+from django.conf import settings
+from django.db import connection, IntegrityError
+from django.db.models import F
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENABLED = getattr(settings, 'STORYMARKET_PROFILE_CONVERTERS', False)
+SLOW_SECONDS = getattr(settings, 'STORYMARKET_SLOW_CONVERTER_SECONDS', 1.0)
+SLOW_QUERIES = getattr(settings, 'STORYMARKET_SLOW_CONVERTER_QUERIES', 10)
+
+log = logging.getLogger('django_storymarket')
+
+def _peak_memory():
+    """Peak resident memory of this process, in KB, or 0 if unknown."""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class _CountingCursor(object):
+    """
+    Wraps a database cursor, counting the queries run through it.
+    """
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter[0] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter[0] += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+def profile(registry_key, converter, api, instance):
+    """
+    Call ``converter(api, instance)``, recording how expensive it was
+    under ``registry_key``. Returns whatever the converter returns.
+    """
+    # Count queries by wrapping the cursors handed out during the call.
+    # connection.queries is no good: it's only kept with DEBUG on. The
+    # connection's attributes are per-thread, so this only counts queries
+    # made by this thread.
+    counter = [0]
+    had_cursor = 'cursor' in connection.__dict__
+    previous_cursor = connection.cursor
+    connection.cursor = lambda: _CountingCursor(previous_cursor(), counter)
+    memory_before = _peak_memory()
+    start = time.time()
+    try:
+        return converter(api, instance)
+    finally:
+        elapsed = time.time() - start
+        num_queries = counter[0]
+        memory = max(_peak_memory() - memory_before, 0)
+        if had_cursor:
+            connection.cursor = previous_cursor
+        else:
+            del connection.cursor
+
+        slow = elapsed > SLOW_SECONDS or num_queries > SLOW_QUERIES
+        if slow:
+            log.warning("Slow converter for %s (pk=%s): %.1fms, %d queries.",
+                        registry_key, instance.pk, elapsed * 1000, num_queries)
+        record(registry_key, elapsed, num_queries, memory, slow)
+
+def record(registry_key, elapsed, num_queries, memory, slow=False):
+    """
+    Add a single call's numbers to the stored profile for ``registry_key``.
+    """
+    from .models import ConverterProfile
+
+    profiles = ConverterProfile.objects.filter(model=registry_key)
+    updated = profiles.update(
+        calls         = F('calls') + 1,
+        slow_calls    = F('slow_calls') + int(slow),
+        total_time    = F('total_time') + elapsed,
+        total_queries = F('total_queries') + num_queries,
+    )
+    if not updated:
+        try:
+            ConverterProfile.objects.create(
+                model         = registry_key,
+                calls         = 1,
+                slow_calls    = int(slow),
+                total_time    = elapsed,
+                max_time      = elapsed,
+                total_queries = num_queries,
+                max_queries   = num_queries,
+                max_memory    = memory,
+            )
+            return
+        except IntegrityError:
+            # Somebody else created it first; just record again.
+            return record(registry_key, elapsed, num_queries, memory, slow)
+
+    profiles.filter(max_time__lt=elapsed).update(max_time=elapsed)
+    profiles.filter(max_queries__lt=num_queries).update(max_queries=num_queries)
+    profiles.filter(max_memory__lt=memory).update(max_memory=memory)
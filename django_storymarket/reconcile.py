@@ -0,0 +1,220 @@
+"""
+Reconciling local sync records against what's actually on Storymarket.
+
+:func:`reconcile` streams every item of each Storymarket type a page at a
+time, compares each page against the matching
+:class:`~django_storymarket.models.SyncedObject` rows (one query per page),
+and reports:
+
+``drifted``
+    Items whose tags, org, category, pricing or rights differ from what
+    we've recorded.
+``missing``
+    Synced records whose Storymarket item no longer exists. Items can
+    shift between pages while they're listed, so each one not seen is
+    looked up with ``manager.get()`` to make sure; records synced since
+    the reconcile started are left alone.
+``orphaned``
+    Synced records whose Django object no longer exists.
+``untracked``
+    Storymarket items in the account's org that no local record points at.
+    The org is the account's configured ``org`` (see
+    :mod:`django_storymarket.clients`) or, failing that, whichever orgs
+    its records were synced to.
+``incomplete``
+    Types whose items couldn't all be listed. Nothing is reported missing
+    for those (or deleted, with ``fix``), since it can't be told.
+
+With ``fix=True`` drifted records are updated to match Storymarket, and
+missing and orphaned records are deleted (so the objects can be synced
+again).
+
+Remote items are listed with ``manager.all(offset=..., limit=...)``, or in
+one go from clients that can't page. Only the IDs of items seen are held in
+memory; a few bytes per item. Each configured account is reconciled
+against the records synced with it.
+"""
+
+import logging
+
+import datetime
+from django.contrib.contenttypes.models import ContentType
+from . import clients
+from .managers import synced_fields
+from .models import SyncedObject, SyncedBlob, STORYMARKET_TYPES
+from .utils import get_manager
+
+log = logging.getLogger('django_storymarket')
+
+# Fields compared between SyncedObject and the Storymarket item.
+COMPARED_FIELDS = ('tags', 'org', 'category', 'pricing', 'rights')
+
+def iter_remote(manager, page_size=100):
+    """
+    Yield every item from a Storymarket manager, fetching ``page_size`` at
+    a time.
+
+    Pages are read until an empty one, since the server may return fewer
+    items than asked for. Raises ``ValueError`` if the manager ignores
+    ``offset``, rather than looping forever.
+    """
+    offset = 0
+    first_id = None
+    while True:
+        try:
+            page = list(manager.all(offset=offset, limit=page_size))
+        except TypeError:
+            if offset:
+                raise
+            # A client that can't page; take everything at once.
+            for item in manager.all():
+                yield item
+            return
+        if not page:
+            return
+        if offset and page[0].id == first_id:
+            raise ValueError("%s ignores offset; can't page through it." % manager)
+        first_id = page[0].id
+        for item in page:
+            yield item
+        offset += len(page)
+
+def _pages(iterable, size):
+    page = []
+    for item in iterable:
+        page.append(item)
+        if len(page) == size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+def reconcile(fix=False, page_size=100, report=None):
+    """
+    Compare local sync records with Storymarket.
+
+    :param fix: Repair local records as described above.
+    :param page_size: Number of items to fetch per API call.
+    :param report: Optional callable, called as ``report(kind, message)``
+                   for each problem found.
+    :rtype: A dict of counts for each kind of problem.
+    """
+    if report is None:
+        report = lambda kind, message: None
+    counts = dict(drifted=0, missing=0, orphaned=0, untracked=0, incomplete=0)
+    started = datetime.datetime.now()
+    for account in sorted(clients.accounts()):
+        _reconcile_account(account, counts, fix, page_size, report, started)
+    _find_orphans(counts, fix, report)
+    return counts
+
+def _reconcile_account(account, counts, fix, page_size, report, started):
+    """
+    Reconcile the records synced with a single account, adding to ``counts``.
+    Records synced after ``started`` aren't checked for being missing.
+    """
+    api = clients.get_api(account=account)
+    synced = SyncedObject.objects.filter(account=account, storymarket_id__isnull=False)
+
+    types = set(STORYMARKET_TYPES)
+    types.update(synced.values_list('storymarket_type', flat=True).distinct())
+
+    # Only items in our own org(s) ought to have records.
+    org = clients.get_account(account).get('org')
+    if org is not None:
+        orgs = set([org])
+    else:
+        orgs = set(synced.exclude(org=None).values_list('org', flat=True).distinct())
+
+    for storymarket_type in sorted(types):
+        seen = set()
+        try:
+            manager = get_manager(api, storymarket_type)
+            for page in _pages(iter_remote(manager, page_size), page_size):
+                remote = dict((item.id, item) for item in page)
+                seen.update(remote)
+                local = synced.filter(storymarket_type=storymarket_type,
+                                      storymarket_id__in=remote.keys())
+                tracked = set()
+                for so in local:
+                    tracked.add(so.storymarket_id)
+                    fields = synced_fields(remote[so.storymarket_id])
+                    changed = [f for f in COMPARED_FIELDS if getattr(so, f) != fields[f]]
+                    if changed:
+                        counts['drifted'] += 1
+                        report('drifted', "%s: %s changed on Storymarket" % (so, ', '.join(changed)))
+                        if fix:
+                            for f in changed:
+                                setattr(so, f, fields[f])
+                            so.save()
+                for item_id in set(remote) - tracked:
+                    if _org_id(remote[item_id]) not in orgs:
+                        continue
+                    counts['untracked'] += 1
+                    report('untracked', "%s ID=%s on %s isn't synced from here" % (storymarket_type, item_id, account))
+        except Exception, e:
+            log.exception("Couldn't list %s items on %s: %s" % (storymarket_type, account, e))
+            counts['incomplete'] += 1
+            report('incomplete', "Couldn't list all %s items on %s: %s" % (storymarket_type, account, e))
+            continue
+
+        # Anything we have a record of that wasn't listed may be gone.
+        missing = []
+        local_ids = synced.filter(storymarket_type=storymarket_type, last_updated__lte=started)
+        for pk, storymarket_id in local_ids.values_list('pk', 'storymarket_id').iterator():
+            if storymarket_id not in seen and _is_gone(manager, storymarket_id):
+                counts['missing'] += 1
+                report('missing', "%s ID=%s no longer exists on Storymarket" % (storymarket_type, storymarket_id))
+                missing.append((pk, storymarket_id))
+        if fix:
+            for chunk in _pages(missing, 500):
+                SyncedObject.objects.filter(pk__in=[pk for (pk, _) in chunk]).delete()
+                # Blob uploads are only recorded for the default account.
+                if account != clients.DEFAULT_ACCOUNT:
+                    continue
+                SyncedBlob.objects.filter(storymarket_type=storymarket_type,
+                                          storymarket_id__in=[sid for (_, sid) in chunk]).delete()
+
+def _is_gone(manager, storymarket_id):
+    """
+    Does looking up item ``storymarket_id`` come back with a 404? Any other
+    error counts as not knowing, so no.
+    """
+    try:
+        manager.get(storymarket_id)
+    except Exception, e:
+        if (getattr(e, 'code', None) or getattr(e, 'status', None)) == 404:
+            return True
+        log.warning("Couldn't check %s ID=%s: %s" % (manager, storymarket_id, e))
+    return False
+
+def _org_id(item):
+    org = getattr(item, 'org', None)
+    return getattr(org, 'id', org)
+
+def _find_orphans(counts, fix, report, chunk_size=500):
+    """
+    Find SyncedObjects pointing at Django objects that don't exist,
+    checking a chunk of records at a time. The models' base managers are
+    used, so objects a default manager filters out aren't taken for gone.
+    """
+    orphans = []
+    content_type_ids = SyncedObject.objects.values_list('content_type', flat=True).distinct()
+    for ct_id in list(content_type_ids):
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        records = SyncedObject.objects.filter(content_type=ct_id).values_list('pk', 'object_pk')
+        for chunk in _pages(records.iterator(), chunk_size):
+            existing = set()
+            if model is not None:
+                pks = [object_pk for (pk, object_pk) in chunk]
+                existing = set(unicode(pk) for pk in
+                               model._base_manager.filter(pk__in=pks).values_list('pk', flat=True))
+            for pk, object_pk in chunk:
+                if object_pk not in existing:
+                    counts['orphaned'] += 1
+                    report('orphaned', "Synced record %s points at a deleted object" % pk)
+                    orphans.append(pk)
+
+    if fix:
+        for chunk in _pages(orphans, 500):
+            SyncedObject.objects.filter(pk__in=chunk).delete()
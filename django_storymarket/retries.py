@@ -0,0 +1,215 @@
+"""
+Retrying Storymarket API calls, without creating duplicate items.
+
+Calls failing with a transient error -- a timeout, a dropped connection, a
+5xx or a 429 -- are retried up to ``STORYMARKET_RETRY_ATTEMPTS`` times with
+exponential backoff and "full" jitter: the n-th retry waits a random time
+between 0 and ``STORYMARKET_RETRY_BASE_DELAY * 2 ** n`` seconds, capped at
+``STORYMARKET_RETRY_MAX_DELAY``.
+
+Blob uploads can simply be retried. Creates can't: a timeout after the
+request went out leaves us not knowing whether the item exists. So
+:func:`create` first records the object's
+:class:`~django_storymarket.models.SyncedObject` as *pending* under a
+fresh idempotency key, and whenever a create's outcome is unknown -- on a
+retry, or because an earlier sync died leaving the record pending -- it
+looks for the item among the most recent ``STORYMARKET_RETRY_RECONCILE_WINDOW``
+items of the type before creating another. Storymarket doesn't take
+idempotency keys itself, so the key is sent along as a
+``storymarket-sync:<key>`` tag on the item, and items are matched on that.
+The tag's stripped from the tags recorded locally (see
+:func:`strip_sync_tags`), so it isn't sent again on the next sync.
+"""
+
+import time
+import uuid
+import random
+import socket
+import httplib
+import logging
+from django.conf import settings
+from .models import SyncedObject
+
+log = logging.getLogger('django_storymarket')
+
+RETRY_ATTEMPTS = getattr(settings, 'STORYMARKET_RETRY_ATTEMPTS', 3)
+RETRY_BASE_DELAY = getattr(settings, 'STORYMARKET_RETRY_BASE_DELAY', 0.5)
+RETRY_MAX_DELAY = getattr(settings, 'STORYMARKET_RETRY_MAX_DELAY', 30)
+RECONCILE_WINDOW = getattr(settings, 'STORYMARKET_RETRY_RECONCILE_WINDOW', 50)
+
+# HTTP statuses worth retrying. Of these, 429 and 503 mean the request was
+# turned away, so it's known not to have done anything.
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+REJECTED_STATUSES = (429, 503)
+
+# The tag marking the item created by a given attempt.
+SYNC_TAG_PREFIX = 'storymarket-sync:'
+IDEMPOTENCY_TAG = SYNC_TAG_PREFIX + '%s'
+
+def _status(e):
+    return getattr(e, 'code', None) or getattr(e, 'status', None)
+
+def is_transient(e):
+    """
+    Is ``e`` an error that might go away if the call is retried?
+    """
+    import storymarket.exceptions
+    if isinstance(e, (socket.error, httplib.HTTPException)):
+        return True
+    return isinstance(e, storymarket.exceptions.StorymarketError) and _status(e) in RETRY_STATUSES
+
+def may_have_succeeded(e):
+    """
+    Could the call that failed with transient error ``e`` have taken effect
+    anyway?
+    """
+    return _status(e) not in REJECTED_STATUSES
+
+def backoff(retry):
+    """
+    How long to wait (in seconds) before the ``retry``-th retry (from 0).
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retry))
+
+def call(func, args=(), tags=None, before_retry=None, attempts=None):
+    """
+    Call ``func(*args)``, retrying transient errors with backoff. The
+    last error is re-raised once the retries run out.
+
+    :param tags: A metrics tags dict; ``tags['retries']`` is incremented
+                 for each retry.
+    :param before_retry: Called as ``before_retry(error)`` before each
+                         retry. If it returns anything but ``None``, that's
+                         returned instead of retrying.
+    :param attempts: Number of retries (default: ``STORYMARKET_RETRY_ATTEMPTS``).
+    """
+    if attempts is None:
+        attempts = RETRY_ATTEMPTS
+    retry = 0
+    while True:
+        try:
+            return func(*args)
+        except Exception, e:
+            if retry >= attempts or not is_transient(e):
+                raise
+            log.warning("Storymarket call %s failed (%s); retrying." % (getattr(func, '__name__', func), e))
+            time.sleep(backoff(retry))
+            retry += 1
+            if tags is not None:
+                tags['retries'] = tags.get('retries', 0) + 1
+            if before_retry is not None:
+                result = before_retry(e)
+                if result is not None:
+                    return result
+
+def upload_blob(sm_obj, blob, tags=None):
+    """
+    ``sm_obj.upload_blob(blob)``, with retries. Blobs that are file-like
+    objects are rewound before each retry, and not retried if they can't be.
+    """
+    attempts = rewind = None
+    if hasattr(blob, 'read'):
+        if hasattr(blob, 'seek'):
+            start = blob.tell()
+            def rewind(e):
+                blob.seek(start)
+        else:
+            attempts = 0
+    return call(sm_obj.upload_blob, (blob,), tags, rewind, attempts)
+
+def create(manager, obj, storymarket_type, data, tags=None):
+    """
+    ``manager.create(data)`` for syncing ``obj``, with retries, recording a
+    pending ``SyncedObject`` first and making sure not to create the item
+    twice.
+
+    Should be called with the object's sync lock held, so that a pending
+    record always means an earlier sync died mid-create.
+
+    The pending record is written in the caller's transaction. If that's
+    rolled back -- as ``TransactionMiddleware`` does when an admin save
+    fails with a timeout -- the record goes with it, and a manual retry
+    can't tell that the item may exist. Commit before syncing (or sync
+    outside a managed transaction) to be covered.
+
+    If recent items can't be listed to check for a create that may have
+    gone through, the error is raised rather than risking a duplicate.
+    """
+    pending = SyncedObject.objects.for_model(obj).filter(state=SyncedObject.PENDING)
+    for so in pending[:1]:
+        existing = find_created(manager, so.idempotency_key, so.storymarket_id)
+        if existing is not None:
+            log.info("Found %s, created by interrupted sync %s." % (so, so.idempotency_key))
+            return existing
+
+    key = uuid.uuid4().hex
+    so = SyncedObject.objects.mark_pending(obj, storymarket_type, key)
+    data = tag_data(data, key)
+
+    # Once any attempt might have created the item, look before retrying.
+    unknown = []
+    def reconcile(e):
+        if may_have_succeeded(e):
+            unknown.append(e)
+        if unknown:
+            return find_created(manager, key, so.storymarket_id)
+    return call(manager.create, (data,), tags, reconcile)
+
+def tag_data(data, key):
+    """
+    A copy of item ``data`` with the tag for idempotency key ``key`` added
+    (in place of any earlier one). Tags given as a string stay a string.
+    """
+    data = dict(data)
+    tags = strip_sync_tags(data.get('tags'))
+    tag = IDEMPOTENCY_TAG % key
+    if isinstance(tags, (list, tuple)):
+        data['tags'] = list(tags) + [tag]
+    else:
+        data['tags'] = '%s, %s' % (tags, tag) if tags else tag
+    return data
+
+def strip_sync_tags(tags):
+    """
+    ``tags`` (a list or a comma-separated string) without any idempotency
+    tags, in the same form.
+    """
+    split = _split_tags(tags)
+    kept = [t for t in split if not t.startswith(SYNC_TAG_PREFIX)]
+    if len(kept) == len(split):
+        return tags
+    if isinstance(tags, basestring):
+        return ', '.join(kept)
+    return kept
+
+def find_created(manager, key, exclude_id=None):
+    """
+    Look for the item created under idempotency key ``key`` among the
+    manager's most recent items (all of them, from clients that can't
+    page), skipping the item ``exclude_id`` (the one the object was synced
+    to before, if any). Returns ``None`` if there isn't one; errors
+    listing the items are raised.
+    """
+    if not key:
+        return None
+    try:
+        try:
+            recent = manager.all(offset=0, limit=RECONCILE_WINDOW)
+        except TypeError:
+            recent = manager.all()
+    except Exception, e:
+        log.warning("Couldn't list recent Storymarket items to reconcile a create: %s" % e)
+        raise
+    for item in recent:
+        if exclude_id is not None and getattr(item, 'id', None) == exclude_id:
+            continue
+        if IDEMPOTENCY_TAG % key in _split_tags(getattr(item, 'tags', None)):
+            return item
+    return None
+
+def _split_tags(tags):
+    if not tags:
+        return []
+    if isinstance(tags, basestring):
+        return [t.strip() for t in tags.split(',') if t.strip()]
+    return list(tags)
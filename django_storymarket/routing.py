@@ -0,0 +1,65 @@
+"""
+Routing of queued uploads to Celery queues.
+
+By default every queued upload goes to Celery's default queue, so a batch of
+large videos can hold up small photo uploads behind it for hours. These
+settings split them up:
+
+``STORYMARKET_INTERACTIVE_QUEUE``
+    Queue for uploads started by an editor from the admin inline.
+
+``STORYMARKET_LARGE_UPLOAD_QUEUE``
+    Queue for uploads bigger than ``STORYMARKET_LARGE_UPLOAD_BYTES``
+    (default 20 MB), regardless of where they came from.
+
+``STORYMARKET_UPLOAD_QUEUES``
+    A dict mapping Storymarket types (``"photo"``, ``"video"``, ...) to
+    queues, for everything else.
+
+``STORYMARKET_BULK_QUEUE``
+    Queue for anything not covered above.
+
+Any of these left unset means Celery's default queue. Remember to run
+workers consuming each queue you configure.
+
+Uploads are also given a priority -- ``STORYMARKET_INTERACTIVE_PRIORITY``
+(default 9) or ``STORYMARKET_BULK_PRIORITY`` (default 0). The defaults
+assume an AMQP broker such as RabbitMQ, where higher numbers go first (and
+only on queues declared with ``x-max-priority``). Brokers that take 0 as
+the highest priority, like Redis and beanstalk, need the two swapped. Set
+either to ``None`` to send no priority at all.
+"""
+
+from django.conf import settings
+
+INTERACTIVE_QUEUE = getattr(settings, 'STORYMARKET_INTERACTIVE_QUEUE', None)
+LARGE_UPLOAD_QUEUE = getattr(settings, 'STORYMARKET_LARGE_UPLOAD_QUEUE', None)
+LARGE_UPLOAD_BYTES = getattr(settings, 'STORYMARKET_LARGE_UPLOAD_BYTES', 20 * 1024 * 1024)
+UPLOAD_QUEUES = getattr(settings, 'STORYMARKET_UPLOAD_QUEUES', {})
+BULK_QUEUE = getattr(settings, 'STORYMARKET_BULK_QUEUE', None)
+INTERACTIVE_PRIORITY = getattr(settings, 'STORYMARKET_INTERACTIVE_PRIORITY', 9)
+BULK_PRIORITY = getattr(settings, 'STORYMARKET_BULK_PRIORITY', 0)
+
+def upload_options(storymarket_type, size=None, interactive=False):
+    """
+    Return the ``apply_async()`` options for queuing an upload.
+
+    :param storymarket_type: The type of item the blob belongs to.
+    :param size: Size of the blob in bytes, if known.
+    :param interactive: ``True`` if an editor is waiting on this upload.
+    """
+    queue = None
+    if size is not None and size > LARGE_UPLOAD_BYTES:
+        queue = LARGE_UPLOAD_QUEUE
+    if not queue and interactive:
+        queue = INTERACTIVE_QUEUE
+    if not queue:
+        queue = UPLOAD_QUEUES.get(storymarket_type.rstrip('s'), BULK_QUEUE)
+
+    options = {}
+    priority = INTERACTIVE_PRIORITY if interactive else BULK_PRIORITY
+    if priority is not None:
+        options['priority'] = priority
+    if queue:
+        options['queue'] = queue
+    return options
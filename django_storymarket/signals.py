@@ -0,0 +1,11 @@
+"""
+Signals sent by django-storymarket.
+"""
+
+from django.dispatch import Signal
+
+# Sent after each timed stage of a sync (conversion, API create, blob
+# upload, etc.) finishes. ``stage`` is the name of the stage, ``duration``
+# is in seconds, and ``tags`` is a dict describing the work (model,
+# Storymarket type, bytes uploaded, whether it failed, etc.).
+sync_stage_finished = Signal(providing_args=['stage', 'duration', 'tags'])
@@ -0,0 +1,109 @@
+"""
+Cached lookups of whether objects are on Storymarket.
+
+Templates and APIs that show sync status would otherwise need a
+``SyncedObject`` query per object. :func:`get_many` looks up a whole list
+of objects at once -- a single cache round-trip, plus one query per model
+for whatever isn't cached -- and both positive and negative answers are
+cached.
+
+The cache is kept current by signal handlers on
+:class:`~django_storymarket.models.SyncedObject` (see ``models.py``), so
+it's updated by ``mark_synced()``, propagated deletions and reconcile
+fixes alike.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+
+# How long (in seconds) sync status is cached.
+SYNC_STATUS_TIMEOUT = getattr(settings, 'STORYMARKET_SYNC_STATUS_TIMEOUT', 60 * 60)
+
+# Cached for objects that aren't synced (the cache can't tell ``None`` from
+# a miss).
+NOT_SYNCED = 0
+
+def _key(content_type_id, object_pk):
+    return 'storymarket_sync_status:%s:%s' % (content_type_id, object_pk)
+
+def _status(synced_object):
+    if synced_object['storymarket_id'] is None:
+        # A first sync that's still pending.
+        return NOT_SYNCED
+    return {
+        'storymarket_type': synced_object['storymarket_type'],
+        'storymarket_id': synced_object['storymarket_id'],
+        'account': synced_object['account'],
+        'last_updated': synced_object['last_updated'],
+    }
+
+def get(obj):
+    """
+    The sync status of ``obj``: a dict of ``storymarket_type``,
+    ``storymarket_id``, ``account`` and ``last_updated``, or ``None`` if it
+    isn't on Storymarket.
+    """
+    return get_many([obj])[obj]
+
+def get_many(objs):
+    """
+    Look up the sync status of several objects at once.
+
+    :param objs: An iterable of model instances, possibly of different
+                 models.
+    :rtype: A dict mapping each object to its status, as returned by
+            :func:`get`.
+    """
+    # Imported here: models imports this module to connect the handlers.
+    from .models import SyncedObject
+
+    keys = {}
+    for obj in objs:
+        ct = ContentType.objects.get_for_model(obj)
+        keys[obj] = _key(ct.id, obj.pk)
+    cached = cache.get_many(keys.values())
+
+    # Anything not in the cache is looked up with a query per model.
+    missing = {}
+    for obj, key in keys.items():
+        if key not in cached:
+            ct = ContentType.objects.get_for_model(obj)
+            missing.setdefault(ct.id, set()).add(unicode(obj.pk))
+    fetched = {}
+    for ct_id, pks in missing.items():
+        for pk in pks:
+            fetched[_key(ct_id, pk)] = NOT_SYNCED
+        records = SyncedObject.objects.filter(content_type=ct_id, object_pk__in=pks).values(
+            'object_pk', 'storymarket_type', 'storymarket_id', 'account', 'last_updated')
+        for record in records:
+            fetched[_key(ct_id, record['object_pk'])] = _status(record)
+    if fetched:
+        cache.set_many(fetched, SYNC_STATUS_TIMEOUT)
+        cached.update(fetched)
+
+    return dict((obj, cached[key] or None) for obj, key in keys.items())
+
+def annotate(objs, attr='storymarket_status'):
+    """
+    Set ``attr`` on each of ``objs`` to its sync status, with a single
+    :func:`get_many` lookup. Returns ``objs``.
+    """
+    statuses = get_many(objs)
+    for obj in objs:
+        setattr(obj, attr, statuses[obj])
+    return objs
+
+def remember(synced_object):
+    """
+    Cache the status of a just-saved ``SyncedObject``.
+    """
+    cache.set(_key(synced_object.content_type_id, synced_object.object_pk),
+              _status(synced_object.__dict__), SYNC_STATUS_TIMEOUT)
+
+def forget(synced_object):
+    """
+    Cache that a just-deleted ``SyncedObject``'s object isn't synced any more.
+    """
+    cache.set(_key(synced_object.content_type_id, synced_object.object_pk),
+              NOT_SYNCED, SYNC_STATUS_TIMEOUT)
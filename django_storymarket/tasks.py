@@ -4,6 +4,9 @@ Celery task defintions.
 Queuing uploads with Celery is optional, but high recommended.
 """
 
+from django.contrib.contenttypes.models import ContentType
+from . import blobs, budgets
+
 # Nose tries to auto-import this module, which of course
 # fails if Celery isn't installed. Doing this lets the
 # tests run.
@@ -13,5 +16,37 @@ except ImportError:
     def task(func): return func
 
 @task
-def upload_blob_task(sm_obj, blob):
-    sm_obj.upload_blob(blob)
\ No newline at end of file
+def upload_blob_task(sm_obj, blob, content_hash=None, tags=None):
+    # ``tags`` are the metrics tags of the sync that queued the upload.
+    tags = dict(tags or {})
+    tags.setdefault('storymarket_type', sm_obj.__class__.__name__.lower())
+    request = getattr(upload_blob_task, 'request', None)
+    blobs.upload(sm_obj, blob, content_hash,
+                 retries=getattr(request, 'retries', 0),
+                 queued=True, **tags)
+
+@task
+def save_to_storymarket_task(content_type_id, object_pk, storymarket_type, choices=None, interactive=False):
+    # ``choices`` override the converted data, like the admin's form does.
+    from . import converters
+    from .utils import save_to_storymarket
+    obj = ContentType.objects.get_for_id(content_type_id).get_object_for_this_type(pk=object_pk)
+    try:
+        data = converters.convert(obj)
+        data.pop('type')
+        data.update(choices or {})
+        save_to_storymarket(obj, storymarket_type, data, interactive)
+    except Exception, e:
+        budgets.set_queued_status(obj, 'failed', unicode(e))
+        raise
+    budgets.clear_queued_status(obj)
+
+@task
+def propagate_deletions_task(batch_size=500):
+    from .deletions import propagate_deletions
+    return propagate_deletions(batch_size)
+
+@task
+def prune_history_task(days=None):
+    from .history import prune
+    return prune(days)
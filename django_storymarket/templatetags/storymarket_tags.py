@@ -0,0 +1,55 @@
+"""
+Template tags for showing Storymarket sync status.
+
+Annotate a list of objects up front, so the whole list costs a single
+lookup::
+
+    {% load storymarket_tags %}
+    {% storymarket_status story_list %}
+    {% for story in story_list %}
+        {% if story.storymarket_status %}
+            On Storymarket as {{ story.storymarket_status.storymarket_type }}
+            #{{ story.storymarket_status.storymarket_id }}
+        {% endif %}
+    {% endfor %}
+
+For a one-off object there's also a filter: ``{{ story|storymarket_status }}``.
+"""
+
+from django import template
+from .. import syncstatus
+
+register = template.Library()
+
+class StorymarketStatusNode(template.Node):
+    def __init__(self, objects):
+        self.objects = template.Variable(objects)
+
+    def render(self, context):
+        try:
+            objects = self.objects.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+        syncstatus.annotate(objects)
+        return ''
+
+@register.tag
+def storymarket_status(parser, token):
+    """
+    ``{% storymarket_status object_list %}`` sets ``storymarket_status`` on
+    each object in the list (see :func:`syncstatus.get`).
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("%r takes a single argument: a list of objects." % bits[0])
+    return StorymarketStatusNode(bits[1])
+
+@register.filter(name='storymarket_status')
+def storymarket_status_filter(obj):
+    """
+    The sync status of a single object, preferring one set by the
+    ``storymarket_status`` tag.
+    """
+    if hasattr(obj, 'storymarket_status'):
+        return obj.storymarket_status
+    return syncstatus.get(obj)
@@ -0,0 +1,50 @@
+import mock
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import backfill
+from django_storymarket.models import SyncedObject, BackfillShard
+
+class BackfillTests(TestCase):
+    def setUp(self):
+        # Sparse pks: a pk-range split would make mostly empty shards.
+        for pk in (1, 2, 3, 1000, 5000):
+            User.objects.create(pk=pk, username='user%s' % pk)
+
+    def test_shards_follow_actual_pks(self):
+        shards = backfill.plan_shards('test', User, 2)
+        self.assertEqual(sorted((s.start_pk, s.end_pk) for s in shards),
+                         [(1, 3), (3, 5000), (5000, 5001)])
+
+        # Planning again resumes the same shards.
+        self.assertEqual(len(backfill.plan_shards('test', User, 2)), 3)
+        self.assertEqual(BackfillShard.objects.count(), 3)
+
+    def test_shard_queryset_skips_synced(self):
+        SyncedObject.objects.create(
+            content_type=ContentType.objects.get_for_model(User), object_pk='2',
+            storymarket_type='text', storymarket_id=12, tags='', org=1, category=1)
+        SyncedObject.objects.create(
+            content_type=ContentType.objects.get_for_model(User), object_pk='1',
+            storymarket_type='text', tags='', state=SyncedObject.PENDING, idempotency_key='abc')
+        [shard, _, _] = sorted(backfill.plan_shards('test', User, 2), key=lambda s: s.start_pk)
+        self.assertEqual(list(backfill.shard_queryset(shard).values_list('pk', flat=True)), [1])
+        self.assertEqual(list(backfill.shard_queryset(shard, resync=True).values_list('pk', flat=True)), [1, 2])
+
+    @mock.patch('django_storymarket.backfill.save_to_storymarket')
+    @mock.patch('django_storymarket.backfill.converters.convert')
+    def test_process_shard(self, mock_convert, mock_save):
+        mock_convert.return_value = {'type': 'text', 'title': 'Hi'}
+        mock_save.side_effect = [None, Exception('Oops')]
+        shard = min(backfill.plan_shards('test', User, 2), key=lambda s: s.start_pk)
+
+        shard = backfill.process_shard(shard.pk)
+        self.assertEqual((shard.synced, shard.failed, shard.last_pk, shard.done), (1, 1, 2, True))
+        self.assertEqual(list(backfill.shard_queryset(shard, resync=True)), [])
+
+    @mock.patch('django_storymarket.planning.converters.convert')
+    def test_plan_backfill(self, mock_convert):
+        mock_convert.return_value = {'type': 'text', 'title': 'Hi'}
+        plan = backfill.plan_backfill(User, 2)
+        self.assertEqual(plan.creates, 5)
+        self.assertEqual(BackfillShard.objects.count(), 0)
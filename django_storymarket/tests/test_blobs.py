@@ -0,0 +1,33 @@
+import hashlib
+import StringIO
+from nose.tools import assert_equal
+from django_storymarket import blobs
+
+DATA = 'x' * (blobs.CHUNK_SIZE * 2 + 10)
+DATA_HASH = hashlib.sha1(DATA).hexdigest()
+
+class Unseekable(object):
+    def __init__(self, data):
+        self._f = StringIO.StringIO(data)
+        
+    def read(self, size=-1):
+        return self._f.read(size)
+
+def test_hash_string():
+    assert_equal(blobs.hash_blob(DATA), (DATA_HASH, DATA))
+
+def test_hash_file_is_rewound():
+    f = StringIO.StringIO(DATA)
+    content_hash, blob = blobs.hash_blob(f)
+    assert_equal(content_hash, DATA_HASH)
+    assert blob is f
+    assert_equal(blob.read(), DATA)
+
+def test_hash_unseekable_is_spooled():
+    content_hash, blob = blobs.hash_blob(Unseekable(DATA))
+    assert_equal(content_hash, DATA_HASH)
+    assert_equal(blob.read(), DATA)
+
+def test_blob_size():
+    assert_equal(blobs.blob_size(DATA), len(DATA))
+    assert_equal(blobs.blob_size(Unseekable(DATA)), None)
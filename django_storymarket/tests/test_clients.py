@@ -0,0 +1,41 @@
+import mock
+from nose.tools import assert_equal, assert_raises
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django_storymarket import clients
+
+ACCOUNTS = {'other': {'api_key': 'other-key', 'rate_limit': 5}}
+
+def test_default_account():
+    with mock.patch.object(clients, '_router', None):
+        assert_equal(clients.account_for(mock.Mock()), clients.DEFAULT_ACCOUNT)
+        assert_equal(clients.account_for(None), clients.DEFAULT_ACCOUNT)
+
+def test_routed_account():
+    router = lambda instance: instance.account
+    with mock.patch.object(clients, '_router', router):
+        assert_equal(clients.account_for(mock.Mock(account='other')), 'other')
+        assert_equal(clients.account_for(mock.Mock(account=None)), clients.DEFAULT_ACCOUNT)
+
+def test_unknown_account():
+    assert_raises(ImproperlyConfigured, clients.get_account, 'nonexistent')
+
+def test_clients_are_pooled():
+    with mock.patch.object(settings, 'STORYMARKET_ACCOUNTS', ACCOUNTS, create=True):
+        with mock.patch('storymarket.Storymarket') as mock_api_class:
+            api = clients.get_api(account=clients.DEFAULT_ACCOUNT)
+            assert clients.get_api(account=clients.DEFAULT_ACCOUNT) is api
+
+            # Rate-limited accounts get a throttled client with their own key.
+            other = clients.get_api(account='other')
+            assert other is not api
+            assert isinstance(other, clients._ThrottledAPI)
+            mock_api_class.assert_called_with('other-key')
+
+def test_throttled_calls_take_tokens():
+    api = mock.Mock()
+    bucket = mock.Mock()
+    throttled = clients._ThrottledAPI(api, bucket)
+    throttled.photos.create({'title': 'Hi'})
+    assert bucket.take.called
+    api.photos.create.assert_called_with({'title': 'Hi'})
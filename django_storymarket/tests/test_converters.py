@@ -1,11 +1,15 @@
 import mock
+from contextlib import nested
 from nose.tools import assert_equal
 from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
 from django_storymarket import converters
-from django_storymarket.models import SyncedObject
+from django_storymarket.models import SyncedObject, AutoSyncedModel
 
 def test_autodiscover():
     converters._discovery_done = False
+    cache.delete(converters._snapshot_key())
     with mock.patch.object(converters, 'import_module') as mocked:
 
         # We expect import_module to be called once for each module in INSTALLED_APPS
@@ -20,6 +24,24 @@ def test_autodiscover():
         mocked.reset_mock()
         converters.autodiscover()
         assert not mocked.called
+
+def test_autodiscover_snapshot():
+    converters._discovery_done = False
+    cache.set(converters._snapshot_key(), ['someapp.storymarket_converters'])
+    try:
+        with mock.patch.object(converters, 'import_module') as mocked:
+            # With a snapshot, only the modules in it are imported.
+            converters.autodiscover()
+            assert_equal([args for (args, kwargs) in mocked.call_args_list],
+                         [('someapp.storymarket_converters',)])
+    finally:
+        cache.delete(converters._snapshot_key())
+
+def test_snapshot_key_changes_with_app_directories():
+    key = converters._snapshot_key()
+    assert_equal(converters._snapshot_key(), key)
+    with mock.patch('os.stat', mock.Mock(return_value=mock.Mock(st_mtime=1.0))):
+        assert converters._snapshot_key() != key
         
 def test_register():
     converters._registry = {}
@@ -29,4 +51,63 @@ def test_register():
     assert_equal(converters.registered_models(), [SyncedObject])
     
     converters.unregister(SyncedObject)
-    assert_equal(converters.registered_models(), [])
\ No newline at end of file
+    assert_equal(converters.registered_models(), [])
+class ProxySyncedObject(SyncedObject):
+    class Meta:
+        proxy = True
+        app_label = 'django_storymarket'
+
+def test_subclass_dispatch():
+    converters._registry = {}
+    callback = lambda api, obj: {}
+    fallback = lambda api, obj: {}
+    
+    converters.register(SyncedObject, callback)
+    assert converters.get_converter(ProxySyncedObject) is callback
+    assert converters.get_converter(SyncedObject) is callback
+    assert converters.get_converter(AutoSyncedModel) is None
+    
+    # Registering a fallback clears the cached "no converter" lookup.
+    converters.register_fallback_converter(fallback)
+    assert converters.get_converter(AutoSyncedModel) is fallback
+    
+    converters.unregister(SyncedObject)
+    converters.unregister_fallback_converter()
+    assert converters.get_converter(ProxySyncedObject) is None
+
+def test_conversion_cache():
+    converters._registry = {}
+    callback = mock.Mock(return_value={'type': 'text', 'title': 'hi'})
+    converters.register(User, callback)
+    user = User(pk=1)
+    
+    with nested(mock.patch('storymarket.Storymarket'),
+                mock.patch.object(converters, 'CONVERT_CACHE_TIMEOUT', 600)):
+        first = converters.convert(user)
+        first.pop('type')
+        
+        # The second conversion comes from the cache, and is a fresh copy.
+        assert_equal(converters.convert(user), {'type': 'text', 'title': 'hi'})
+        assert_equal(callback.call_count, 1)
+        
+        # Saving invalidates it.
+        converters.invalidate_conversion(User, user)
+        converters.convert(user)
+        assert_equal(callback.call_count, 2)
+    
+    # Caching is off by default.
+    with mock.patch('storymarket.Storymarket'):
+        converters.convert(user)
+        converters.convert(user)
+        assert_equal(callback.call_count, 4)
+    
+    converters.unregister(User)
+
+def test_fallback_saves_dont_invalidate():
+    converters._registry = {}
+    converters.register_fallback_converter(lambda api, obj: {'type': 'text'})
+    with nested(mock.patch.object(converters, 'CONVERT_CACHE_TIMEOUT', 600),
+                mock.patch.object(converters, 'cache')) as (_, mock_cache):
+        converters.invalidate_conversion(User, User(pk=1))
+        assert not mock_cache.set.called
+    converters.unregister_fallback_converter()
@@ -0,0 +1,89 @@
+import mock
+from django.test import TestCase
+from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import converters, deletions
+from django_storymarket.models import SyncedObject, SyncedBlob, SyncTombstone
+
+def sync(obj, storymarket_id):
+    return SyncedObject.objects.create(
+        content_type=ContentType.objects.get_for_model(obj), object_pk=obj.pk,
+        storymarket_type='text', storymarket_id=storymarket_id, tags='', org=1, category=1)
+
+class DeletionTests(TestCase):
+    def setUp(self):
+        self._registry = converters._registry
+        converters._registry = {}
+        converters._invalidate()
+        converters.register(User, lambda api, obj: {'type': 'text'})
+        self.api = mock.Mock()
+        self.patcher = mock.patch('django_storymarket.deletions.clients.get_api', return_value=self.api)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        converters._registry = self._registry
+        converters._invalidate()
+
+    def test_tombstones(self):
+        User.objects.create(username='registered').delete()
+        self.assertEqual(SyncTombstone.objects.count(), 1)
+
+        # Objects with only the fallback converter need a sync record.
+        converters.register_fallback_converter(lambda api, obj: {'type': 'text'})
+        Group.objects.create(name='unsynced').delete()
+        self.assertEqual(SyncTombstone.objects.count(), 1)
+        group = Group.objects.create(name='synced')
+        sync(group, 3)
+        group.delete()
+        self.assertEqual(SyncTombstone.objects.count(), 2)
+
+    def test_propagate(self):
+        users = [User.objects.create(username='user%s' % i) for i in range(5)]
+        for i, user in enumerate(users):
+            sync(user, i + 1)
+        SyncedBlob.objects.create(content_hash='abc', storymarket_type='text', storymarket_id=1)
+        self.api.text.delete.side_effect = lambda storymarket_id: {3: Exception('Oops')}.get(storymarket_id)
+        for user in users[:3]:
+            user.delete()
+
+        self.assertEqual(deletions.propagate_deletions(batch_size=2), (2, 1))
+        self.assertEqual(sorted(args for (args, kwargs) in self.api.text.delete.call_args_list),
+                         [(1,), (2,), (3,)])
+        self.assertEqual(SyncedBlob.objects.count(), 0)
+
+        # The failure's kept to be retried.
+        self.assertEqual(list(SyncedObject.objects.order_by('storymarket_id').values_list('storymarket_id', flat=True)),
+                         [3, 4, 5])
+        self.assertEqual(SyncTombstone.objects.get().object_pk, str(users[2].pk))
+
+    def test_shared_items_arent_deleted(self):
+        first, second, third = [User.objects.create(username=name) for name in ('a', 'b', 'c')]
+        for user in (first, second, third):
+            sync(user, 7)
+        first.delete()
+        second.delete()
+
+        # The item's still synced to the third user.
+        self.assertEqual(deletions.propagate_deletions(), (0, 0))
+        assert not self.api.text.delete.called
+        self.assertEqual(SyncedObject.objects.get().object_pk, str(third.pk))
+        self.assertEqual(SyncTombstone.objects.count(), 0)
+
+        # Once that's gone too, so is the item -- deleted once.
+        third.delete()
+        self.assertEqual(deletions.propagate_deletions(), (1, 0))
+        self.api.text.delete.assert_called_with(7)
+
+    def test_undeletable_items(self):
+        sync(User.objects.create(username='a'), 1)
+        sync(User.objects.create(username='b'), 2)
+        self.api.text = mock.Mock(spec=['get', 'create'])
+        error = Exception('Not found')
+        error.status = 404
+        self.api.photos.delete.side_effect = error
+        SyncedObject.objects.filter(storymarket_id=2).update(storymarket_type='photos')
+        User.objects.all().delete()
+
+        self.assertEqual(deletions.propagate_deletions(), (2, 0))
+        self.assertEqual((SyncedObject.objects.count(), SyncTombstone.objects.count()), (0, 0))
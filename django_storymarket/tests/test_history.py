@@ -0,0 +1,59 @@
+import datetime
+import threading
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import history
+from django_storymarket.models import SyncAttempt, SyncRollup
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='synced')
+
+    def test_batched_record(self):
+        now = datetime.datetime.now()
+        with history.batch():
+            history.record(self.user, 'text', now, 0.5)
+            history.record(self.user, 'photo', now, 1.5, bytes=100, error='Timed out')
+            self.assertEqual(SyncAttempt.objects.count(), 0)
+        self.assertEqual(SyncAttempt.objects.count(), 2)
+
+        failed = SyncAttempt.objects.get(succeeded=False)
+        self.assertEqual((failed.storymarket_type, failed.bytes, failed.error), ('photo', 100, 'Timed out'))
+
+        [stats] = history.model_stats(datetime.date.today())
+        self.assertEqual(stats['model'], ContentType.objects.get_for_model(User))
+        self.assertEqual((stats['attempts'], stats['failures'], stats['error_rate']), (2, 1, 0.5))
+        self.assertEqual(stats['mean_duration'], 1.0)
+
+    def test_batches_are_per_thread(self):
+        now = datetime.datetime.now()
+        with history.batch():
+            history.record(self.user, 'text', now, 0.5)
+            # Another thread's batch isn't this one's, so it can't pick
+            # up (or flush) this thread's attempts.
+            seen = []
+            thread = threading.Thread(target=lambda: seen.append(len(history._buffer())))
+            thread.start()
+            thread.join()
+            self.assertEqual(seen, [0])
+            self.assertEqual(len(history._buffer()), 1)
+        self.assertEqual(SyncAttempt.objects.count(), 1)
+
+    def test_prune(self):
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time(12))
+        for days_ago in (40, 40, 2, 0):
+            history.record(self.user, 'text', today - datetime.timedelta(days=days_ago), 1,
+                           error='Oops' if days_ago == 2 else None)
+
+        rolled_up, deleted = history.prune(days=30)
+        self.assertEqual((rolled_up, deleted), (40, 2))
+        self.assertEqual(SyncAttempt.objects.count(), 2)
+
+        # The pruned attempts live on in the rollups.
+        old_day = (today - datetime.timedelta(days=40)).date()
+        self.assertEqual(SyncRollup.objects.get(day=old_day).attempts, 2)
+
+        # Stats combine rollups with today's attempts.
+        [stats] = history.model_stats(old_day)
+        self.assertEqual((stats['attempts'], stats['failures']), (4, 1))
@@ -0,0 +1,53 @@
+import mock
+from nose.tools import assert_equal, assert_raises
+from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django_storymarket import locks, utils
+from django_storymarket.models import SyncedObject
+
+def test_acquire_release():
+    obj = mock.Mock()
+    lock = locks.SyncLock(obj)
+
+    assert_equal(lock.acquire(), True)
+    assert_equal(cache.get(lock.key), lock.token)
+
+    lock.release()
+    assert_equal(cache.get(lock.key), None)
+
+def test_contended_lock_times_out():
+    obj = mock.Mock()
+    holder = locks.SyncLock(obj)
+    holder.acquire()
+
+    try:
+        waiter = locks.SyncLock(obj, wait=0)
+        assert_raises(locks.SyncLockTimeout, waiter.acquire)
+
+        # Releasing someone else's lock is a no-op.
+        waiter.release()
+        assert_equal(cache.get(holder.key), holder.token)
+    finally:
+        holder.release()
+
+class ContendedSyncTests(TestCase):
+    def test_waiter_returns_the_other_syncs_result(self):
+        user = User.objects.create(username='story')
+        holder = locks.SyncLock(user)
+        holder.acquire()
+        
+        # While we wait, the other sync finishes.
+        def finish_other_sync(seconds):
+            sm_obj = mock.Mock(id=12, tags='news', org=mock.Mock(id=1), category=mock.Mock(id=1),
+                               pricing_scheme=None, rights_scheme=None)
+            SyncedObject.objects.mark_synced(user, sm_obj)
+            holder.release()
+        
+        with mock.patch('storymarket.Storymarket') as mock_api:
+            with mock.patch('time.sleep', mock.Mock(side_effect=finish_other_sync)):
+                so, created = utils.save_to_storymarket(user, 'text', {'title': 'Hi'})
+        
+        assert_equal((so.storymarket_id, created), (12, False))
+        assert not mock_api.return_value.text.create.called
+        assert_equal(cache.get(holder.key), None)
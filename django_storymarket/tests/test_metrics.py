@@ -0,0 +1,29 @@
+import mock
+from nose.tools import assert_equal, assert_raises
+from django_storymarket import metrics
+from django_storymarket.signals import sync_stage_finished
+
+def test_timer_sends_signal():
+    received = []
+    def receiver(sender, stage, duration, tags, **kwargs):
+        received.append((stage, tags))
+    sync_stage_finished.connect(receiver)
+    
+    try:
+        with metrics.timer('create', model='auth.user') as tags:
+            tags['bytes'] = 10
+    finally:
+        sync_stage_finished.disconnect(receiver)
+    
+    assert_equal(received, [('create', {'model': 'auth.user', 'bytes': 10})])
+
+def test_timer_counts_errors():
+    backend = mock.Mock()
+    with mock.patch.object(metrics, '_backend', backend):
+        def failing():
+            with metrics.timer('convert'):
+                raise ValueError
+        assert_raises(ValueError, failing)
+    
+    backend.incr.assert_any_call('storymarket.convert.errors', tags={'failed': True})
+    assert backend.timing.called
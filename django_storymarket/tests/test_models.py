@@ -43,4 +43,27 @@ class AutoSyncedModelTests(TestCase):
         # Not enabled: no
         asm.enabled = False
         self.assertEqual(asm.should_sync(User()), False)
-        
\ No newline at end of file
+        
+    def test_sync_pks(self):
+        asm = AutoSyncedModel.objects.get(pk=1)
+        joe = User.objects.create(username='joe', email='joe@example.com')
+        jane = User.objects.create(username='jane', email='jane@example.invalid')
+        bob = User.objects.create(username='bob', email='bob@example.com')
+        asm.rules.create(include=True, field='username', op='startswith', value='j')
+        asm.rules.create(include=False, field='email', op='endswith', value='.invalid')
+        
+        # Plain fields are checked over value rows...
+        self.assertEqual(list(asm.sync_pks(batch_size=1)), [joe.pk])
+        
+        # ... and the results agree with checking instances.
+        self.assertEqual([u.pk for u in User.objects.order_by('pk') if asm.should_sync(u)], [joe.pk])
+        
+        # Rules on non-fields fall back to instances.
+        asm.rules.create(include=True, field='is_anonymous', op='ne', value='x')
+        self.assertEqual(list(asm.sync_pks()), [joe.pk])
+        
+    def test_negated_rule(self):
+        asm = AutoSyncedModel.objects.get(pk=1)
+        rule = asm.rules.create(include=True, field='username', op='!startswith', value='j')
+        self.assertEqual(rule.should_sync(User(username='bob')), True)
+        self.assertEqual(rule.should_sync(User(username='joe')), False)
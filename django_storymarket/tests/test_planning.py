@@ -0,0 +1,21 @@
+import mock
+from nose.tools import assert_equal
+from django_storymarket.models import SyncedObject
+from django_storymarket.planning import SyncPlan
+
+def test_plan_package():
+    obj1, obj2, obj3 = mock.Mock(), mock.Mock(), mock.Mock()
+    data = {'items': [{'type': 'photos', 'object': obj2, 'blob': 'x' * 100},
+                      {'type': 'video', 'object': obj3, 'blob': 'y' * 50}]}
+    
+    # obj2 has been synced before; the others haven't.
+    for_model = mock.Mock(side_effect=lambda obj: mock.Mock(**{'filter.return_value.exists.return_value': obj is obj2}))
+    with mock.patch.object(SyncedObject.objects, 'for_model', for_model):
+        plan = SyncPlan()
+        plan.add_converted(obj1, 'package', data)
+    
+    assert_equal((plan.creates, plan.updates, plan.blobs, plan.bytes), (2, 1, 2, 150))
+    assert_equal(plan.api_calls, 5)
+    
+    # The data's left alone.
+    assert_equal(data['items'][0]['object'], obj2)
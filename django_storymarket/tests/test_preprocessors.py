@@ -0,0 +1,48 @@
+import mock
+import shutil
+import tempfile
+import StringIO
+from contextlib import nested
+from nose.plugins.skip import SkipTest
+from django.core.files.storage import FileSystemStorage
+from django_storymarket import preprocessors
+
+def patch_preprocessor(func):
+    storage = FileSystemStorage(location=tempfile.mkdtemp())
+    return storage, nested(
+        mock.patch.object(preprocessors, '_preprocessors', {'photo': func}),
+        mock.patch.object(preprocessors, 'default_storage', storage),
+    )
+
+def test_no_preprocessor():
+    blob = StringIO.StringIO('...')
+    with mock.patch.object(preprocessors, '_preprocessors', {'text': None}):
+        assert preprocessors.preprocess('text', blob) is blob
+
+def test_preprocessed_once():
+    func = mock.Mock(return_value='small')
+    storage, patches = patch_preprocessor(func)
+    try:
+        with patches:
+            assert preprocessors.preprocess('photos', StringIO.StringIO('big')) == 'small'
+            
+            # The same blob again comes from storage (as a string; the file
+            # isn't left open), and different blobs are processed anew.
+            assert preprocessors.preprocess('photo', 'big') == 'small'
+            assert func.call_count == 1
+            preprocessors.preprocess('photo', 'other')
+            assert func.call_count == 2
+    finally:
+        shutil.rmtree(storage.location)
+
+def test_downsize_photo():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise SkipTest("PIL isn't installed.")
+    out = StringIO.StringIO()
+    Image.new('RGB', (4000, 3000), 'red').save(out, 'BMP')
+    
+    with mock.patch.object(preprocessors, 'PHOTO_MAX_DIMENSION', 400):
+        processed = preprocessors.downsize_photo(out.getvalue())
+    assert Image.open(StringIO.StringIO(processed)).size == (400, 300)
@@ -0,0 +1,43 @@
+import sys
+import mock
+import StringIO
+from django.test import TestCase
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django_storymarket import profiling
+from django_storymarket.models import ConverterProfile
+
+def user_converter(api, obj):
+    # Two queries.
+    list(User.objects.all())
+    User.objects.filter(pk=obj.pk).exists()
+    return {'type': 'text', 'title': obj.username}
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='story')
+
+    def test_profile_counts_queries_without_debug(self):
+        with mock.patch.object(profiling.settings, 'DEBUG', False):
+            data = profiling.profile('auth.user', user_converter, None, self.user)
+            profiling.profile('auth.user', user_converter, None, self.user)
+        self.assertEqual(data['title'], 'story')
+
+        profile = ConverterProfile.objects.get(model='auth.user')
+        self.assertEqual((profile.calls, profile.total_queries, profile.max_queries), (2, 4, 2))
+
+        # The connection's left as it was.
+        assert 'cursor' not in profiling.connection.__dict__
+
+    def test_slow_calls(self):
+        with mock.patch.object(profiling, 'SLOW_QUERIES', 1):
+            profiling.profile('auth.user', user_converter, None, self.user)
+        self.assertEqual(ConverterProfile.objects.get(model='auth.user').slow_calls, 1)
+
+    def test_report(self):
+        profiling.record('auth.user', 0.5, 3, 100)
+        stdout = StringIO.StringIO()
+        with mock.patch.object(sys, 'stdout', stdout):
+            call_command('storymarket_converter_report', reset=True)
+        assert 'auth.user' in stdout.getvalue()
+        self.assertEqual(ConverterProfile.objects.count(), 0)
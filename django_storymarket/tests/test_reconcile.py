@@ -0,0 +1,84 @@
+import mock
+import datetime
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import reconcile
+from django_storymarket.models import SyncedObject, STORYMARKET_TYPES
+
+def item(id, org=1, tags='news'):
+    return mock.Mock(id=id, tags=tags, org=mock.Mock(id=org), category=mock.Mock(id=1),
+                     pricing_scheme=None, rights_scheme=None)
+
+def not_found(storymarket_id):
+    error = Exception('Not found')
+    error.code = 404
+    raise error
+
+def pager(items, cap=2):
+    # A server returning at most ``cap`` items, whatever the limit.
+    return lambda offset, limit: items[offset:offset + min(limit, cap)]
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.api = mock.Mock()
+        for storymarket_type in STORYMARKET_TYPES:
+            getattr(self.api, storymarket_type).all.return_value = []
+        self.patcher = mock.patch('django_storymarket.reconcile.clients.get_api', return_value=self.api)
+        self.patcher.start()
+
+        ct = ContentType.objects.get_for_model(User)
+        for i in (1, 2, 5):
+            user = User.objects.create(username='user%s' % i)
+            SyncedObject.objects.create(content_type=ct, object_pk=user.pk, storymarket_type='text',
+                                        storymarket_id=i, tags='news', org=1, category=1)
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_reconcile(self):
+        # Item 1 has new tags, item 2 is gone, item 3 isn't ours and item 4
+        # is some other org's. Item 5 is past a short page.
+        self.api.text.all.side_effect = pager([item(1, tags='sport'), item(3), item(4, org=9), item(5)])
+        self.api.text.get.side_effect = not_found
+        counts = reconcile.reconcile(fix=True, page_size=3)
+        self.assertEqual(counts, dict(drifted=1, missing=1, orphaned=0, untracked=1, incomplete=0))
+        self.assertEqual(sorted(SyncedObject.objects.values_list('storymarket_id', 'tags')),
+                         [(1, 'sport'), (5, 'news')])
+
+    def test_unlisted_items_are_checked(self):
+        # Item 2 shifted out of the listing but still exists, and item 5
+        # was synced after the reconcile started.
+        SyncedObject.objects.filter(storymarket_id=5).update(
+            last_updated=datetime.datetime.now() + datetime.timedelta(hours=1))
+        self.api.text.all.side_effect = pager([item(1)])
+        counts = reconcile.reconcile(fix=True)
+        self.assertEqual(counts['missing'], 0)
+        self.api.text.get.assert_called_once_with(2)
+        self.assertEqual(SyncedObject.objects.count(), 3)
+
+    def test_filtered_default_managers(self):
+        # A default manager hiding objects doesn't make them orphans.
+        with mock.patch.object(User, '_default_manager', User.objects.none()):
+            counts = reconcile.reconcile(fix=True)
+        self.assertEqual(counts['orphaned'], 0)
+        self.assertEqual(SyncedObject.objects.count(), 3)
+
+    def test_incomplete_listing_deletes_nothing(self):
+        def all(offset, limit):
+            if offset:
+                raise IOError('Connection reset')
+            return [item(1)]
+        self.api.text.all.side_effect = all
+        counts = reconcile.reconcile(fix=True, page_size=1)
+        self.assertEqual((counts['missing'], counts['incomplete']), (0, 1))
+        self.assertEqual(SyncedObject.objects.count(), 3)
+
+    def test_unpaged_client(self):
+        def all(**kwargs):
+            if kwargs:
+                raise TypeError("all() got an unexpected keyword argument 'offset'")
+            return [item(1), item(2), item(5)]
+        self.api.text.all.side_effect = all
+        counts = reconcile.reconcile()
+        self.assertEqual((counts['missing'], counts['untracked'], counts['incomplete']), (0, 0, 0))
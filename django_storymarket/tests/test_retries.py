@@ -0,0 +1,115 @@
+import mock
+import socket
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import retries
+from django_storymarket.models import SyncedObject
+
+def _split(tags):
+    return [t.strip() for t in tags.split(',')]
+
+class RetryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='story')
+
+    @mock.patch('time.sleep')
+    def test_transient_errors_are_retried(self, sleep):
+        func = mock.Mock(side_effect=[socket.timeout(), socket.error(), 'ok'])
+        tags = {}
+        self.assertEqual(retries.call(func, tags=tags), 'ok')
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual((func.call_count, tags['retries']), (3, 2))
+
+        func = mock.Mock(side_effect=ValueError())
+        self.assertRaises(ValueError, retries.call, func)
+        self.assertEqual(func.call_count, 1)
+
+        func = mock.Mock(side_effect=socket.timeout())
+        self.assertRaises(socket.timeout, retries.call, func, attempts=2)
+        self.assertEqual(func.call_count, 3)
+
+    def test_backoff_is_capped(self):
+        with mock.patch.object(retries, 'RETRY_MAX_DELAY', 5):
+            assert all(0 <= retries.backoff(n) <= 5 for n in range(20))
+
+    @mock.patch('time.sleep')
+    def test_create_after_timeout_doesnt_duplicate(self, sleep):
+        manager = mock.Mock()
+        def create(data):
+            # The create goes through, but the response is lost.
+            manager.all.return_value = [mock.Mock(id=1, title='Hi', tags=['news']),
+                                        mock.Mock(id=2, title='Hi', tags=data['tags'])]
+            raise socket.timeout()
+        manager.create.side_effect = create
+
+        created = retries.create(manager, self.user, 'text', {'title': 'Hi', 'tags': 'news'})
+        self.assertEqual(created.id, 2)
+        self.assertEqual(manager.create.call_count, 1)
+
+        so = SyncedObject.objects.for_model(self.user).get()
+        self.assertEqual(so.state, SyncedObject.PENDING)
+        sent = manager.create.call_args[0][0]
+        self.assertEqual(sent['tags'], 'news, storymarket-sync:%s' % so.idempotency_key)
+
+    def test_resyncs_dont_pile_up_tags(self):
+        manager = mock.Mock()
+        manager.create.side_effect = lambda data: mock.Mock(
+            id=1, tags=data['tags'], org=mock.Mock(id=1), category=mock.Mock(id=1),
+            pricing_scheme=None, rights_scheme=None)
+
+        # The tags recorded (and so offered by the admin form next time)
+        # don't include the marker, and a stale marker isn't sent again.
+        tags = 'news, storymarket-sync:old'
+        for i in range(3):
+            created = retries.create(manager, self.user, 'text', {'title': 'Hi', 'tags': tags})
+            so, _ = SyncedObject.objects.mark_synced(self.user, created)
+            tags = so.tags
+            self.assertEqual(tags, 'news')
+            self.assertEqual(_split(manager.create.call_args[0][0]['tags']).count('news'), 1)
+            self.assertEqual(len(_split(manager.create.call_args[0][0]['tags'])), 2)
+
+        self.assertEqual(retries.tag_data({'tags': ['a']}, 'k')['tags'], ['a', 'storymarket-sync:k'])
+
+    def test_interrupted_create_is_reconciled(self):
+        SyncedObject.objects.mark_pending(self.user, 'text', 'abc123')
+        created = mock.Mock(id=3, tags='news, storymarket-sync:abc123')
+        manager = mock.Mock()
+        manager.all.return_value = [mock.Mock(id=2, tags='news'), created]
+
+        self.assertEqual(retries.create(manager, self.user, 'text', {'title': 'Hi'}), created)
+        assert not manager.create.called
+
+    @mock.patch('time.sleep')
+    def test_unchecked_create_isnt_retried(self, sleep):
+        manager = mock.Mock()
+        manager.create.side_effect = socket.timeout()
+        manager.all.side_effect = ValueError('Listing failed')
+        self.assertRaises(ValueError, retries.create, manager, self.user, 'text', {'title': 'Hi'})
+        self.assertEqual(manager.create.call_count, 1)
+
+    def test_unpaged_client_is_checked(self):
+        SyncedObject.objects.mark_pending(self.user, 'text', 'abc123')
+        created = mock.Mock(id=3, tags='storymarket-sync:abc123')
+        def all(**kwargs):
+            if kwargs:
+                raise TypeError("all() got an unexpected keyword argument 'offset'")
+            return [created]
+        manager = mock.Mock()
+        manager.all.side_effect = all
+        self.assertEqual(retries.create(manager, self.user, 'text', {'title': 'Hi'}), created)
+        assert not manager.create.called
+
+    def test_previous_item_isnt_mistaken_for_created(self):
+        # The object's still synced to item 5 until the resync finishes,
+        # so item 5 is never taken for the one the resync created.
+        SyncedObject.objects.create(
+            content_type=ContentType.objects.get_for_model(User), object_pk=self.user.pk,
+            storymarket_type='text', storymarket_id=5, tags='', org=1, category=1,
+            state=SyncedObject.PENDING, idempotency_key='abc123')
+        manager = mock.Mock()
+        manager.all.return_value = [mock.Mock(id=5, title='Hi', tags=['storymarket-sync:abc123'])]
+        manager.create.return_value = 'new'
+
+        self.assertEqual(retries.create(manager, self.user, 'text', {'title': 'Hi'}), 'new')
+        self.assertEqual(manager.create.call_count, 1)
@@ -0,0 +1,44 @@
+import datetime
+from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import syncstatus
+from django_storymarket.models import SyncedObject
+
+class SyncStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.synced = User.objects.create(username='synced')
+        self.unsynced = User.objects.create(username='unsynced')
+        self.record = SyncedObject.objects.create(
+            content_type=ContentType.objects.get_for_model(User), object_pk=self.synced.pk,
+            storymarket_type='text', storymarket_id=12, tags='', org=1, category=1)
+
+    def test_get_many_is_cached(self):
+        cache.clear()
+        statuses = syncstatus.get_many([self.synced, self.unsynced])
+        self.assertEqual(statuses[self.synced]['storymarket_id'], 12)
+        self.assertEqual(statuses[self.unsynced], None)
+
+        # Both answers come from the cache the second time around.
+        SyncedObject.objects.all().update(storymarket_id=13)
+        statuses = syncstatus.get_many([self.synced, self.unsynced])
+        self.assertEqual(statuses[self.synced]['storymarket_id'], 12)
+        self.assertEqual(statuses[self.unsynced], None)
+
+    def test_kept_current(self):
+        self.assertEqual(syncstatus.get(self.unsynced), None)
+        SyncedObject.objects.create(
+            content_type=ContentType.objects.get_for_model(User), object_pk=self.unsynced.pk,
+            storymarket_type='text', storymarket_id=14, tags='', org=1, category=1)
+        self.assertEqual(syncstatus.get(self.unsynced)['storymarket_id'], 14)
+
+        self.record.delete()
+        self.assertEqual(syncstatus.get(self.synced), None)
+
+    def test_annotate(self):
+        users = list(User.objects.order_by('username'))
+        syncstatus.annotate(users)
+        self.assertEqual([u.storymarket_status and u.storymarket_status['storymarket_id'] for u in users],
+                         [12, None])
@@ -1,28 +1,38 @@
 import mock
+import threading
 import contextlib
 import unittest
 import storymarket
 from django.conf import settings
-from django_storymarket import utils
+from django_storymarket import history, utils
 from django_storymarket.models import SyncedObject
 
 def setup():
     utils.QUEUE_UPLOADS = False
     settings.STORYMARKET_API_KEY = '1234'
+    
+    # Syncs here are of mock objects, which can't be logged.
+    history.HISTORY_ENABLED = False
+
+def teardown():
+    history.HISTORY_ENABLED = True
 
 def patch_storymarket():
     mock_api = mock.Mock()
     mock_api.return_value = mock.Mock(spec=storymarket.Storymarket(''))
+    # Mock objects can't be marked pending, so skip straight to the create.
+    create = lambda manager, obj, storymarket_type, data, tags=None: manager.create(data)
     return contextlib.nested(
         mock.patch('storymarket.Storymarket', new=mock_api),
         mock.patch.object(SyncedObject.objects, 'mark_synced'),
+        mock.patch('django_storymarket.retries.create', new=create),
     )
 
 def test_save_to_storymarket():
     obj = mock.Mock()
     data = {'hi': 'there', 'blob': '...'}
 
-    with patch_storymarket() as (mock_api, mock_marked):
+    with patch_storymarket() as (mock_api, mock_marked, _):
         utils.save_to_storymarket(obj, 'audio', data)
         
         # The call creates and API instance...
@@ -37,7 +47,7 @@ def test_save_to_storymarket():
         create_rv.upload_blob.assert_called_with('...')
         
         # And calls mark_synced.
-        mock_marked.assert_called_with(obj, create_rv)
+        mock_marked.assert_called_with(obj, create_rv, 'default')
             
 def test_package_saving():
     obj1 = mock.Mock()
@@ -46,7 +56,7 @@ def test_package_saving():
     data = {'items': [{'type': 'photo', 'object': obj2, 'foo': 'bar'},
                       {'type': 'video', 'object': obj3, 'foo': 'baz'}]}
                       
-    with patch_storymarket() as (mock_api, mock_marked):
+    with patch_storymarket() as (mock_api, mock_marked, _):
         utils.save_to_storymarket(obj1, 'package', data)
         
         sm = mock_api.return_value
@@ -56,4 +66,108 @@ def test_package_saving():
         sm.packages.create.assert_called_with({
             'photo_items': [mock_marked.return_value.storymarket_id],
             'video_items': [mock_marked.return_value.storymarket_id]
-        })
\ No newline at end of file
+        })
+
+def test_run_concurrently():
+    results = utils.run_concurrently(lambda x, y: x * y, [(i, 2) for i in range(10)], concurrency=4)
+    assert results == [i * 2 for i in range(10)]
+    
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+    try:
+        utils.run_concurrently(fail_on_three, [(i,) for i in range(10)], concurrency=4)
+    except ValueError, e:
+        assert e.args == (3,)
+    else:
+        raise AssertionError("ValueError not raised")
+
+def test_nested_pools_run_serially():
+    def outer(x):
+        return utils.run_concurrently(lambda: threading.current_thread(), [(), ()], concurrency=4)
+    for inner_threads in utils.run_concurrently(outer, [(1,), (2,)], concurrency=2):
+        assert inner_threads[0] is inner_threads[1]
+
+def test_upload_routing():
+    from django_storymarket import routing
+    with contextlib.nested(
+        mock.patch.object(routing, 'INTERACTIVE_QUEUE', 'interactive'),
+        mock.patch.object(routing, 'LARGE_UPLOAD_QUEUE', 'large'),
+        mock.patch.object(routing, 'UPLOAD_QUEUES', {'video': 'video'}),
+        mock.patch.object(routing, 'BULK_QUEUE', None),
+    ):
+        assert routing.upload_options('photos', 100, interactive=True)['queue'] == 'interactive'
+        assert routing.upload_options('photo', routing.LARGE_UPLOAD_BYTES + 1, interactive=True)['queue'] == 'large'
+        assert routing.upload_options('video', 100)['queue'] == 'video'
+        assert 'queue' not in routing.upload_options('photo', 100)
+    
+    assert routing.upload_options('photo', interactive=True)['priority'] == routing.INTERACTIVE_PRIORITY
+    with mock.patch.object(routing, 'BULK_PRIORITY', None):
+        assert 'priority' not in routing.upload_options('photo')
+
+def test_dispatch_sync_budget():
+    from django_storymarket import budgets
+    obj = mock.Mock()
+    package = {'items': [{}, {}, {}]}
+    
+    with contextlib.nested(
+        mock.patch.object(utils, 'QUEUE_UPLOADS', True),
+        mock.patch.object(utils, 'save_to_storymarket'),
+        mock.patch('django_storymarket.tasks.save_to_storymarket_task'),
+        mock.patch.object(budgets, 'api_latency', mock.Mock(return_value=0.5)),
+        mock.patch.object(utils.ContentType.objects, 'get_for_model'),
+    ) as (_, mock_save, mock_task, _, _):
+        # One create at 0.5s fits in a 1s budget; a four-item package doesn't.
+        utils.dispatch_sync(obj, 'text', {}, budget=1)
+        assert mock_save.called
+        assert not mock_task.apply_async.called
+        
+        mock_save.reset_mock()
+        assert utils.dispatch_sync(obj, 'package', package, budget=1, choices={'org': 1}) is None
+        assert not mock_save.called
+        
+        # Only the object and the choices are queued, not the data.
+        args = mock_task.apply_async.call_args[1]['args']
+        assert args[2:] == ('package', {'org': 1}, False)
+        assert budgets.get_queued_status(obj)['state'] == 'queued'
+        
+        # A successful inline sync clears a queued sync's failure.
+        budgets.set_queued_status(obj, 'failed', 'Timed out')
+        utils.dispatch_sync(obj, 'text', {}, budget=1)
+        assert budgets.get_queued_status(obj) is None
+
+def test_queued_sync_converts_afresh():
+    from django_storymarket import tasks
+    obj = mock.Mock()
+    converted = {'type': 'text', 'title': 'Hi', 'org': 2}
+    
+    with contextlib.nested(
+        mock.patch('django_storymarket.converters.convert', mock.Mock(return_value=converted)),
+        mock.patch.object(utils, 'save_to_storymarket'),
+        mock.patch.object(tasks.ContentType.objects, 'get_for_id'),
+        mock.patch('django_storymarket.budgets.clear_queued_status'),
+    ) as (_, mock_save, mock_get_for_id, _):
+        mock_get_for_id.return_value.get_object_for_this_type.return_value = obj
+        tasks.save_to_storymarket_task(1, 2, 'text', {'org': 1})
+        mock_save.assert_called_with(obj, 'text', {'title': 'Hi', 'org': 1}, False)
+
+def test_duplicate_blob_links_to_existing_item():
+    from django_storymarket import blobs
+    obj = mock.Mock()
+    
+    with contextlib.nested(
+        patch_storymarket(),
+        mock.patch.object(blobs, 'DEDUPLICATE_BLOBS', True),
+        mock.patch.object(blobs, 'find_uploaded', mock.Mock(return_value=mock.Mock(storymarket_id=7))),
+    ) as ((mock_api, mock_marked, _), _, mock_find):
+        utils.save_to_storymarket(obj, 'audio', {'title': 'Hi', 'blob': '...'})
+        
+        # The blob's hash matches an upload, so the object is linked to
+        # that item: nothing's created or uploaded.
+        mock_find.assert_called_with(blobs.hash_blob('...')[0], 'audio')
+        sm = mock_api.return_value
+        sm.audio.get.assert_called_with(7)
+        assert not sm.audio.create.called
+        assert not sm.audio.get.return_value.upload_blob.called
+        mock_marked.assert_called_with(obj, sm.audio.get.return_value, 'default')
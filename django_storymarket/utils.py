@@ -1,22 +1,183 @@
-import storymarket
+import sys
+import Queue
+import time
+import datetime
+import threading
 from django.conf import settings
+from django.db import connection
+from django.contrib.contenttypes.models import ContentType
+from django_storymarket import blobs, budgets, clients, history, metrics, retries, routing
 from django_storymarket.models import SyncedObject
+from django_storymarket.locks import SyncLock
 
 QUEUE_UPLOADS = getattr(settings, 'STORYMARKET_QUEUE_UPLOADS', False)
-if QUEUE_UPLOADS:
-    from .tasks import upload_blob_task
 
+# How many uploads bulk_save_to_storymarket() and packages keep in flight.
+SYNC_CONCURRENCY = getattr(settings, 'STORYMARKET_SYNC_CONCURRENCY', 4)
 
-def save_to_storymarket(obj, storymarket_type, data):
+def _tasks():
+    # Celery's only imported when something's actually queued.
+    from django_storymarket import tasks
+    return tasks
+
+
+def save_to_storymarket(obj, storymarket_type, data, interactive=False, account=None):
     """
     Push an object to Storymarket.
     
     Called from the various parts of the admin that need to upload
     objects -- ``save_model``, the ``upload_to_storymarket`` action,
     etc.
-    """    
+    
+    Syncs of a single object are serialized with a :class:`SyncLock`. If
+    another sync of ``obj`` is already running we wait for it, and if it
+    synced the object in the meantime its result is returned instead of
+    creating a duplicate Storymarket item.
+    
+    Pass ``interactive=True`` when somebody's waiting on the result (e.g.
+    an editor saving the object); queued uploads are then routed ahead of
+    bulk work. See :mod:`django_storymarket.routing`.
+    
+    The object goes to ``account`` if given, or else to whichever account
+    ``STORYMARKET_ACCOUNT_ROUTER`` picks for it; see
+    :mod:`django_storymarket.clients`.
+    
+    Each attempt is logged to :mod:`django_storymarket.history`.
+    """
+    if account is None:
+        account = clients.account_for(obj)
+    started = datetime.datetime.now()
+    lock = SyncLock(obj)
+    uncontended = lock.acquire()
+    try:
+        if not uncontended:
+            synced = SyncedObject.objects.for_model(obj).filter(last_updated__gte=started,
+                                                                state=SyncedObject.SYNCED)
+            for so in synced[:1]:
+                return so, False
+        
+        size = blobs.blob_size(data['blob']) if data.get('blob') else None
+        start_time = time.time()
+        try:
+            result = _save_to_storymarket(obj, storymarket_type, data, interactive, account)
+        except Exception, e:
+            history.record(obj, storymarket_type, started, time.time() - start_time, size,
+                           error=unicode(e) or e.__class__.__name__)
+            raise
+        history.record(obj, storymarket_type, started, time.time() - start_time, size)
+        return result
+    finally:
+        lock.release()
+
+def dispatch_sync(obj, storymarket_type, data, budget=None, interactive=False, choices=None):
+    """
+    Sync an object inline if that's expected to finish within ``budget``
+    seconds, or queue the whole sync with Celery if not.
+    
+    ``data`` is only used inline. The task is just told which object to
+    sync and the ``choices`` (org, category and so on, which must be
+    picklable) to apply on top of converting it afresh -- converted data
+    can hold open files, and would be stale by the time the task ran.
+    
+    Returns ``(SyncedObject, created)`` like :func:`save_to_storymarket` if
+    the sync ran inline, or ``None`` if it was queued; queued syncs can be
+    checked on with :func:`budgets.get_queued_status`. Without
+    ``STORYMARKET_QUEUE_UPLOADS`` everything runs inline.
+    """
+    if not QUEUE_UPLOADS or budgets.fits_budget(storymarket_type, data, budget):
+        result = save_to_storymarket(obj, storymarket_type, data, interactive)
+        # Don't leave an earlier queued sync's failure showing.
+        budgets.clear_queued_status(obj)
+        return result
+    
+    budgets.set_queued_status(obj, 'queued')
+    ct = ContentType.objects.get_for_model(obj)
+    options = routing.upload_options(storymarket_type, interactive=interactive)
+    _tasks().save_to_storymarket_task.apply_async(
+        args=(ct.id, obj.pk, storymarket_type, choices or {}, interactive), **options)
+    return None
+
+def bulk_save_to_storymarket(items, concurrency=None):
+    """
+    Push many objects to Storymarket at once.
+    
+    ``items`` is a list of ``(obj, storymarket_type, data)`` tuples, as
+    would be passed to :func:`save_to_storymarket`. Up to ``concurrency``
+    (default: ``STORYMARKET_SYNC_CONCURRENCY``) uploads are in flight at
+    a time, so a single worker isn't stuck waiting on one API call after
+    another.
+    
+    Returns a list of ``(SyncedObject, created)`` in the same order as
+    ``items``. If any upload fails the first error is re-raised once the
+    rest have finished.
+    """
+    with history.batch():
+        return run_concurrently(save_to_storymarket, items, concurrency)
+
+_pool_local = threading.local()
+
+def run_concurrently(func, arg_list, concurrency=None):
+    """
+    Call ``func(*args)`` for each ``args`` in ``arg_list`` on a pool of up
+    to ``concurrency`` threads, returning the results in order.
+    
+    Each thread gets (and closes) its own database connection, *outside*
+    the caller's transaction: the threads can't see rows the caller hasn't
+    committed yet, and on SQLite they'll block on (or fail with "database
+    is locked" behind) a write transaction the caller holds open. With an
+    in-memory SQLite database each thread even sees a different, empty
+    database. Commit first, or pass ``concurrency=1`` to run everything in
+    the calling thread.
+    
+    Calls made from inside a pool run serially, so nesting (packages in a
+    bulk upload, say) doesn't multiply the number of threads.
+    """
+    arg_list = list(arg_list)
+    if concurrency is None:
+        concurrency = SYNC_CONCURRENCY
+    if getattr(_pool_local, 'in_pool', False):
+        concurrency = 1
+    if concurrency <= 1 or len(arg_list) <= 1:
+        return [func(*args) for args in arg_list]
+    
+    results = [None] * len(arg_list)
+    errors = []
+    work = Queue.Queue()
+    for i, args in enumerate(arg_list):
+        work.put((i, args))
+    
+    def worker():
+        _pool_local.in_pool = True
+        try:
+            # Each thread logs its syncs on its own connection, so write
+            # them in one go before closing it.
+            with history.batch():
+                while True:
+                    try:
+                        i, args = work.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        results[i] = func(*args)
+                    except Exception:
+                        errors.append((i, sys.exc_info()))
+        finally:
+            connection.close()
+    
+    threads = [threading.Thread(target=worker) for _ in range(min(concurrency, len(arg_list)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    if errors:
+        i, (exc_type, exc_value, tb) = min(errors)
+        raise exc_type, exc_value, tb
+    return results
+
+def _save_to_storymarket(obj, storymarket_type, data, interactive, account):
     # TODO: should figure out how to do an update if the object already exists.
-    api = storymarket.Storymarket(settings.STORYMARKET_API_KEY)
+    api = clients.get_api(account=account)
 
     # Fix some field names mapping from local to storymarket names
     if 'pricing' in data:
@@ -26,37 +187,66 @@ def save_to_storymarket(obj, storymarket_type, data):
 
     # Packages are handled slightly different: each sub-item has to be
     # uploaded first, then the package needs to be created.
+    # The sub-items don't depend on each other, so they go up concurrently,
+    # to the package's account.
     if storymarket_type == 'package':
-        package_items = data.pop('items')
-        for subitem in package_items:
+        subitems = []
+        for subitem in data.pop('items'):
             subobj = subitem.pop('object')
             subtype = subitem.pop('type').rstrip('s')
-            synced, created = save_to_storymarket(subobj, subtype, subitem)
+            subitems.append((subobj, subtype, subitem, interactive, account))
+        results = run_concurrently(save_to_storymarket, subitems)
+        for (subobj, subtype, subitem, _, _), (synced, created) in zip(subitems, results):
             data.setdefault('%s_items' % subtype, []).append(synced.storymarket_id)
     
-    # Grab the appropriate manager for the given storymarket type.
-    # We want to "be liberal in what [we] accept," so try both with
-    # and without a trailing "s" -- this allows "photo" as well
-    # as "photos", for example.
-    try:
-        manager = getattr(api, storymarket_type)
-    except AttributeError:
-        try:
-            manager = getattr(api, storymarket_type+'s')
-        except AttributeError:
-            raise ValueError("Invalid storymarket type: %r" % storymarket_type)
+    manager = get_manager(api, storymarket_type)
     
     # Pull out the blob from the data since it gets uploaded seperately.
     blob = data.pop('blob', None)
+    tags = dict(model=str(obj._meta), storymarket_type=storymarket_type)
+    
+    # If this exact blob's been uploaded before, link to that item rather
+    # than uploading it all over again. Uploads aren't recorded per account,
+    # so this only happens on the default account.
+    content_hash = None
+    if blob and blobs.DEDUPLICATE_BLOBS and account == clients.DEFAULT_ACCOUNT:
+        content_hash, blob = blobs.hash_blob(blob)
+        uploaded = blobs.find_uploaded(content_hash, storymarket_type)
+        if uploaded:
+            sm_obj = manager.get(uploaded.storymarket_id)
+            with metrics.timer('mark_synced', deduplicated=True, **tags):
+                return SyncedObject.objects.mark_synced(obj, sm_obj, account)
     
-    sm_obj = manager.create(data)
+    # Transient errors are retried; see retries.create() for how that
+    # avoids duplicates.
+    with metrics.timer('create', **tags) as create_tags:
+        sm_obj = retries.create(manager, obj, storymarket_type, data, create_tags)
 
     # Upload the blob. This queues nad backgrounds the task using
     # Celery if STORYMARKET_QUEUE_UPLOADS is True.
     if blob:
         if QUEUE_UPLOADS:
-            upload_blob_task.delay(sm_obj, blob)
+            options = routing.upload_options(storymarket_type, blobs.blob_size(blob), interactive)
+            _tasks().upload_blob_task.apply_async(args=(sm_obj, blob, content_hash),
+                                                  kwargs={'tags': tags}, **options)
         else:
-            sm_obj.upload_blob(blob)
+            blobs.upload(sm_obj, blob, content_hash, **tags)
+
+    with metrics.timer('mark_synced', **tags):
+        return SyncedObject.objects.mark_synced(obj, sm_obj, account)
 
-    return SyncedObject.objects.mark_synced(obj, sm_obj)
+def get_manager(api, storymarket_type):
+    """
+    Grab the appropriate API manager for the given storymarket type.
+    
+    We want to "be liberal in what [we] accept," so try both with
+    and without a trailing "s" -- this allows "photo" as well
+    as "photos", for example.
+    """
+    try:
+        return getattr(api, storymarket_type)
+    except AttributeError:
+        try:
+            return getattr(api, storymarket_type+'s')
+        except AttributeError:
+            raise ValueError("Invalid storymarket type: %r" % storymarket_type)
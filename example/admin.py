@@ -1,11 +1,12 @@
 from __future__ import absolute_import
 
 from django.contrib import admin
-from django_storymarket.admin import upload_to_storymarket, is_synced_to_storymarket, StorymarketUploaderInline
+from django_storymarket.admin import (upload_to_storymarket, plan_storymarket_upload,
+                                      is_synced_to_storymarket, StorymarketUploaderInline)
 from .models import ExampleStory
 
 class ExampleStoryAdmin(admin.ModelAdmin):
-    actions = [upload_to_storymarket]
+    actions = [upload_to_storymarket, plan_storymarket_upload]
     list_display = ['headline', is_synced_to_storymarket]
     inlines = [StorymarketUploaderInline]
 
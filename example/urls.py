@@ -1,5 +1,6 @@
 from django.conf.urls.defaults import *
 from django.contrib import admin; admin.autodiscover()
+from django_storymarket import converters; converters.autodiscover()
 
 urlpatterns = patterns('',
     (r'^admin/', include(admin.site.urls)),